@@ -0,0 +1,100 @@
+"""
+Keyset (seek) pagination for long lists.
+
+A page is fetched with WHERE (a, b) > (last a, last b) ORDER BY a, b LIMIT n
+instead of OFFSET, so page 500 costs the same as page 1 as long as an index
+covers the ordering. The ordering must end with a unique column (usually
+the id) so no row is skipped or repeated. The cursor handed to the client
+is the last row's ordering values, base64-encoded JSON.
+"""
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor, length):
+    """The values of a cursor; raises ValueError if it was tampered with."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as exc:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return values
+
+
+def _value(obj, path):
+    for name in path.split('__'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _after(ordering, values):
+    """Q for the rows that come after `values` in `ordering` (fields, '-' for descending)."""
+    conditions = []
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        equal = {previous.lstrip('-'): value for previous, value in zip(ordering[:i], values)}
+        conditions.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+    # The OR alone is not a range the database can seek to; the redundant
+    # bound on the first column is
+    first = ordering[0]
+    bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+    return bound & reduce(or_, conditions)
+
+
+def keyset_page(queryset, ordering, cursor=None, size=50):
+    """
+    The page of `queryset` that follows `cursor` (None: the first page),
+    ordered by `ordering`, a list of field paths such as
+    ['employee__last_name', 'employee_id'] or ['-date', '-id']. Raises
+    ValueError on a malformed cursor.
+    """
+    ordering = list(ordering)
+    if cursor:
+        values = decode_cursor(cursor, len(ordering))
+        try:
+            # Values of the wrong type fail here, when the lookups are prepared
+            queryset = queryset.filter(_after(ordering, values))
+        except (ValidationError, TypeError, ValueError) as exc:
+            raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+    items = list(queryset.order_by(*ordering)[:size + 1])
+
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        next_cursor = encode_cursor([_value(items[-1], field.lstrip('-')) for field in ordering])
+    return KeysetPage(items, next_cursor)
+
+
+def capped_count(queryset, cap=1000):
+    """
+    Number of rows of `queryset`, counting no further than `cap` + 1: more
+    than `cap` means "over `cap`", and the count never scans a whole table.
+    """
+    return queryset.order_by()[:cap + 1].count()
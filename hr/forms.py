@@ -63,6 +63,38 @@ class EmployeeDocumentForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'rows': 3, 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
         }
 
+class AttendanceFilterForm(forms.Form):
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}))
+    # Name or email, matched with the employee search (hr/search.py): a
+    # select of every employee does not scale
+    employee = forms.CharField(required=False, max_length=100, widget=forms.TextInput(attrs={'placeholder': 'Name or email', 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}))
+    department = forms.ModelChoiceField(queryset=Department.objects.none(), required=False, empty_label='All departments', widget=forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Built per request, so the tenant filter of the manager applies
+        self.fields['department'].queryset = Department.objects.order_by('name')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError("The start date must be before the end date.")
+        return cleaned_data
+
+class PunchUploadForm(forms.Form):
+    punch_file = forms.FileField(
+        label="Punch file",
+        help_text="CSV with employee, timestamp and direction columns, or NDJSON with the same keys.",
+        widget=forms.ClearableFileInput(attrs={'accept': '.csv,.ndjson,.jsonl,text/csv', 'class': 'mt-1 block w-full text-sm text-gray-700'}),
+    )
+
+    @property
+    def file_format(self):
+        name = self.cleaned_data['punch_file'].name.lower()
+        return 'ndjson' if name.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
 class AttendanceForm(forms.ModelForm):
     class Meta:
         model = Attendance
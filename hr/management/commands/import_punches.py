@@ -0,0 +1,56 @@
+import csv
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Company
+from hr.punches import PUNCH_FILE_FORMATS, import_punches
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports a time-clock punch file (CSV or NDJSON) into attendance "
+        "records, one per employee and day. Nothing is written unless every "
+        "punch is valid; days already recorded are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Punch file, or - to read standard input")
+        parser.add_argument('--company', required=True, help="Slug of the company the punches belong to")
+        parser.add_argument('--format', choices=PUNCH_FILE_FORMATS, dest='file_format',
+                            help="File format (default: from the file extension, csv otherwise)")
+
+    def handle(self, *args, **options):
+        try:
+            company = Company.objects.get(slug=options['company'])
+        except Company.DoesNotExist:
+            raise CommandError(f"No company with slug {options['company']!r}")
+
+        path = options['path']
+        file_format = options['file_format'] or (
+            'ndjson' if path.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+        )
+        try:
+            if path == '-':
+                result = import_punches(sys.stdin, company, file_format)
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as lines:
+                    result = import_punches(lines, company, file_format)
+        except (OSError, UnicodeDecodeError, ValueError, csv.Error) as exc:
+            raise CommandError(f"Unreadable file: {exc}")
+
+        if result.error_count:
+            for error in result.errors:
+                self.stderr.write(f"  {error}")
+            if result.error_count > len(result.errors):
+                self.stderr.write(f"  and {result.error_count - len(result.errors)} more")
+            raise CommandError(f"Nothing was imported: {result.error_count} invalid punches")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {result.punches} punches: created {result.created} attendance records, "
+            f"skipped {result.duplicates} days already recorded"
+        ))
+        if result.warning_count:
+            self.stdout.write(self.style.WARNING(f"{result.warning_count} punches were not recorded:"))
+            for warning in result.warnings:
+                self.stdout.write(f"  {warning}")
+            if result.warning_count > len(result.warnings):
+                self.stdout.write(f"  and {result.warning_count - len(result.warnings)} more")
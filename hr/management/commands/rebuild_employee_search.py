@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from hr.search import rebuild_search_index, search_available
+
+
+class Command(BaseCommand):
+    help = (
+        "Refills the employee search index from the employee table, e.g. "
+        "after a restore or after employees were written with bulk_create() "
+        "or update(), which do not update it."
+    )
+
+    def handle(self, *args, **options):
+        if not search_available():
+            self.stdout.write("No search index on this database (SQLite with FTS5 only); nothing to do")
+            return
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} employees"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_user_role'),
+        ('hr', '0004_employeedocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['company', 'last_name', 'id'], name='employee_company_name_idx'),
+        ),
+    ]
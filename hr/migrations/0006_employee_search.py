@@ -0,0 +1,86 @@
+from django.db import migrations, OperationalError
+
+# Employee search index, SQLite only (see hr/search.py). Other databases keep
+# the icontains fallback.
+TABLE = 'hr_employee_search'
+
+ROW = """
+    SELECT {employee}.id, {employee}.first_name || ' ' || {employee}.last_name, {employee}.email,
+           COALESCE((SELECT name FROM hr_department WHERE id = {employee}.department_id), ''),
+           COALESCE((SELECT title FROM hr_position WHERE id = {employee}.position_id), ''),
+           'c' || {employee}.company_id
+"""
+INSERT = f"INSERT INTO {TABLE} (rowid, name, email, department, position, tenant)"
+
+CREATE = [
+    # The tenant is an indexed token ('c<company_id>') so filtering by company
+    # is part of the MATCH; '@' and '.' keep an email in one token
+    f"""CREATE VIRTUAL TABLE {TABLE} USING fts5(
+        name, email, department, position, tenant,
+        tokenize = "unicode61 remove_diacritics 2 tokenchars '@.'",
+        prefix = '2 3'
+    )""",
+    f"{INSERT} {ROW.format(employee='hr_employee')} FROM hr_employee",
+    f"""CREATE TRIGGER {TABLE}_insert AFTER INSERT ON hr_employee BEGIN
+        {INSERT} {ROW.format(employee='new')};
+    END""",
+    f"""CREATE TRIGGER {TABLE}_update
+    AFTER UPDATE OF first_name, last_name, email, department_id, position_id, company_id ON hr_employee BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id;
+        {INSERT} {ROW.format(employee='new')};
+    END""",
+    f"""CREATE TRIGGER {TABLE}_delete AFTER DELETE ON hr_employee BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER {TABLE}_department AFTER UPDATE OF name ON hr_department BEGIN
+        UPDATE {TABLE} SET department = new.name
+        WHERE rowid IN (SELECT id FROM hr_employee WHERE department_id = new.id);
+    END""",
+    f"""CREATE TRIGGER {TABLE}_position AFTER UPDATE OF title ON hr_position BEGIN
+        UPDATE {TABLE} SET position = new.title
+        WHERE rowid IN (SELECT id FROM hr_employee WHERE position_id = new.id);
+    END""",
+]
+
+DROP = [
+    f"DROP TRIGGER IF EXISTS {TABLE}_{name}"
+    for name in ('insert', 'update', 'delete', 'department', 'position')
+] + [f"DROP TABLE IF EXISTS {TABLE}"]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        # Savepoint, so a build without FTS5 leaves the migration usable
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SAVEPOINT hr_employee_search")
+            try:
+                for statement in CREATE:
+                    cursor.execute(statement)
+            except OperationalError:
+                cursor.execute("ROLLBACK TO SAVEPOINT hr_employee_search")
+                raise
+            finally:
+                cursor.execute("RELEASE SAVEPOINT hr_employee_search")
+    except OperationalError:
+        pass
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in DROP:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr', '0005_employee_company_name_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
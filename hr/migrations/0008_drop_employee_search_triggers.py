@@ -0,0 +1,26 @@
+from django.db import migrations
+
+# The employee search index is kept in sync from hr.signals. Triggers on
+# the department and position tables that read hr_employee break every
+# SQLite migration that remakes hr_employee, and remaking it drops the
+# employee triggers without notice.
+TABLE = 'hr_employee_search'
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name in ('insert', 'update', 'delete', 'department', 'position'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {TABLE}_{name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr', '0007_attendance_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_triggers, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,10 @@
 
 from django.db import models
+from django.db.models import F, Sum, Case, When, Value, ExpressionWrapper
 from django.utils import timezone
-from core.models import TenantAwareModel
+from core.models import TenantAwareModel, TenantAwareManager
 from datetime import timedelta
+from decimal import Decimal
 
 class Department(TenantAwareModel):
     name = models.CharField(max_length=100)
@@ -41,6 +43,12 @@ class Employee(TenantAwareModel):
     salary = models.DecimalField(max_digits=10, decimal_places=2)
     bank_account = models.CharField(max_length=50)
 
+    class Meta:
+        indexes = [
+            # Lists ordered by name and paginated by keyset (payroll run screen)
+            models.Index(fields=['company', 'last_name', 'id'], name='employee_company_name_idx'),
+        ]
+
     def get_years_of_service(self):
         today = timezone.now().date()
         return (today - self.hire_date).days // 365
@@ -100,11 +108,67 @@ class LeaveRequest(TenantAwareModel):
     def __str__(self):
         return f"{self.employee} - {self.leave_type} ({self.start_date})"
 
+class AttendanceQuerySet(models.QuerySet):
+    STANDARD_SHIFT = timedelta(hours=8)
+
+    def hours_by_employee(self):
+        """
+        Totals worked and overtime time per employee in one grouped query,
+        without loading the punches as model instances.
+        Returns {employee_id: (worked_seconds, overtime_seconds)} as integers,
+        so callers can turn them into exact Decimal hours (see seconds_to_hours).
+        Same rules as get_hours_worked()/get_overtime_hours(): open punches
+        count as 0 and overtime is anything past 8 hours on a given record.
+        """
+        worked = ExpressionWrapper(F('check_out') - F('check_in'), output_field=models.DurationField())
+        overtime = Case(
+            When(worked__gt=self.STANDARD_SHIFT, then=ExpressionWrapper(
+                F('worked') - Value(self.STANDARD_SHIFT), output_field=models.DurationField()
+            )),
+            default=Value(timedelta(0)),
+            output_field=models.DurationField(),
+        )
+        rows = (
+            self.filter(check_out__isnull=False)
+            .alias(worked=worked)
+            .values('employee_id')
+            .annotate(worked_total=Sum('worked'), overtime_total=Sum(overtime))
+            .order_by()
+        )
+        return {
+            row['employee_id']: (_whole_seconds(row['worked_total']), _whole_seconds(row['overtime_total']))
+            for row in rows
+        }
+
+def _whole_seconds(duration):
+    # Durations come back as timedelta on every backend; punches are
+    # accounted to the nearest whole second using integer maths only.
+    seconds, remainder = divmod(duration, timedelta(seconds=1))
+    if remainder >= timedelta(microseconds=500000):
+        seconds += 1
+    return seconds
+
+AttendanceManager = TenantAwareManager.from_queryset(AttendanceQuerySet)
+
+def seconds_to_hours(seconds):
+    """Converts an integer number of seconds to Decimal hours."""
+    return Decimal(seconds) / Decimal('3600')
+
 class Attendance(TenantAwareModel):
     employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='attendance_records')
     date = models.DateField(default=timezone.now)
     check_in = models.TimeField()
     check_out = models.TimeField(null=True, blank=True)
+
+    objects = AttendanceManager()
+
+    class Meta:
+        indexes = [
+            # Attendance browser, newest first and by date range (keyset pagination)
+            models.Index(fields=['company', 'date'], name='attendance_company_date_idx'),
+            # One employee's punches over a period (payroll, clock in/out)
+            models.Index(fields=['employee', 'date'], name='attendance_employee_date_idx'),
+        ]
     
     def get_hours_worked(self):
         if self.check_in and self.check_out:
@@ -0,0 +1,246 @@
+"""
+Bulk import of time-clock punch files.
+
+A punch is one clock event: an employee (id or email), a timestamp and an
+optional direction, 'in' or 'out'. Files are CSV, with employee, timestamp
+and direction columns, or NDJSON, one {"employee": ..., "timestamp": ...,
+"direction": ...} object per line. Timestamps are ISO 8601; aware ones are
+converted to local time.
+
+The file is read as a stream and validated PUNCH_CHUNK_SIZE punches at a
+time, resolving the chunk's employees in one query. Punches are paired per
+employee and day as they come: the first 'in' is the check in and the last
+'out' the check out; punches without a direction count as the earliest and
+latest of the day. Only those times are kept, so memory grows with the
+employee-days of the file, not with its punches.
+
+A record holds one day, so a shift crossing midnight cannot be stored whole:
+an out punch with no in punch that day (the end of the previous night's
+shift) and an out punch before the day's in punch are not recorded, and
+are listed as warnings rather than rejecting the file. The in punch is kept
+as an open record.
+
+Days that already have an attendance record are skipped and the record is
+left as it is. The rest are written with bulk_create in one transaction,
+and only when every punch is valid. bulk_create sends no post_save, so
+hr.signals.attendance_imported is sent instead (payroll flags the payslips
+of those employees and dates).
+"""
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Attendance, Employee
+from .signals import attendance_imported
+
+PUNCH_FILE_FORMATS = ('csv', 'ndjson')
+PUNCH_CHUNK_SIZE = 2000
+BATCH_SIZE = 1000
+# Errors listed; the rest are only counted
+MAX_ERRORS = 50
+
+_DIRECTIONS = {'': None, 'in': 'in', 'i': 'in', 'out': 'out', 'o': 'out'}
+
+
+class PunchImport:
+    """Punches of one file, paired per employee and day, and the outcome of the import."""
+
+    def __init__(self):
+        self.punches = 0
+        # (employee_id, date) -> [first in, last out, earliest, latest]
+        self.days = {}
+        self.created = 0
+        self.duplicates = 0
+        self.errors = []
+        self.error_count = 0
+        # Punches read but not recorded (overnight shifts)
+        self.warnings = []
+        self.warning_count = 0
+
+    def error(self, label, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"{label}: {message}")
+
+    def warn(self, label, message):
+        self.warning_count += 1
+        if len(self.warnings) < MAX_ERRORS:
+            self.warnings.append(f"{label}: {message}")
+
+    def add(self, employee_id, moment, direction):
+        self.punches += 1
+        day = self.days.setdefault((employee_id, moment.date()), [None, None, None, None])
+        time = moment.time()
+        if direction == 'in':
+            day[0] = time if day[0] is None else min(day[0], time)
+        elif direction == 'out':
+            day[1] = time if day[1] is None else max(day[1], time)
+        else:
+            day[2] = time if day[2] is None else min(day[2], time)
+            day[3] = time if day[3] is None else max(day[3], time)
+
+    def check_times(self):
+        """
+        (check_in, check_out) of each paired day. Out punches a day record
+        cannot hold are dropped with a warning, as are days with no in punch.
+        """
+        times = {}
+        for (employee_id, date), (first_in, last_out, earliest, latest) in self.days.items():
+            label = f"Employee {employee_id} on {date}"
+            check_in = first_in or earliest
+            if check_in is None:
+                self.warn(label, f"out punch at {last_out} without an in punch that day (overnight shift?), not recorded")
+                continue
+            check_out = last_out or latest
+            if check_out is not None and check_out <= check_in:
+                if check_out < check_in:
+                    self.warn(label, f"out punch at {check_out} before the in punch at {check_in} (overnight shift?), "
+                                     "recorded without a check out")
+                check_out = None
+            times[employee_id, date] = (check_in, check_out)
+        return times
+
+    def records(self, company, times):
+        """Unsaved Attendance records of the `times` returned by check_times()."""
+        for (employee_id, date), (check_in, check_out) in times.items():
+            yield Attendance(company=company, employee_id=employee_id, date=date, check_in=check_in, check_out=check_out)
+
+
+def read_csv(lines):
+    """(label, record) of every row of a CSV punch file."""
+    reader = csv.DictReader(lines)
+    if not {'employee', 'timestamp'} <= set(reader.fieldnames or []):
+        raise ValueError("The file needs employee and timestamp columns.")
+    for row in reader:
+        yield f"Line {reader.line_num}", row
+
+
+def read_ndjson(lines):
+    """(label, record) of every line of an NDJSON punch file; None for a line that is not an object."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            record = None
+        yield f"Line {number}", record if isinstance(record, dict) else None
+
+
+def _identifier(record):
+    return str(record.get('employee') or '').strip()
+
+
+def _resolve_employees(company, chunk, employees):
+    """Adds the employee ids of the chunk's identifiers (id or email) to `employees`."""
+    ids, emails = set(), set()
+    for _, record in chunk:
+        identifier = record and _identifier(record)
+        if not identifier or identifier in employees:
+            continue
+        employees[identifier] = None
+        if identifier.isdigit():
+            ids.add(int(identifier))
+        else:
+            emails.add(identifier)
+    if ids or emails:
+        found = Employee._base_manager.filter(company=company).filter(Q(id__in=ids) | Q(email__in=emails))
+        for employee_id, email in found.values_list('id', 'email'):
+            if employee_id in ids:
+                employees[str(employee_id)] = employee_id
+            if email in emails:
+                employees[email] = employee_id
+
+
+def _parse_moment(value):
+    moment = datetime.fromisoformat(str(value).strip())
+    if timezone.is_aware(moment):
+        moment = timezone.make_naive(moment)
+    return moment.replace(microsecond=0)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def read_punches(lines, company, file_format='csv'):
+    """
+    Validates and pairs the punches of a file (`lines`, an iterable of text
+    lines) for `company`. Raises ValueError when the file itself is unusable.
+    """
+    result = PunchImport()
+    rows = read_ndjson(lines) if file_format == 'ndjson' else read_csv(lines)
+    employees = {}
+    for chunk in _chunks(rows, PUNCH_CHUNK_SIZE):
+        _resolve_employees(company, chunk, employees)
+        for label, record in chunk:
+            if record is None:
+                result.error(label, "not a JSON object")
+                continue
+            identifier = _identifier(record)
+            employee_id = employees.get(identifier)
+            if employee_id is None:
+                result.error(label, f"unknown employee {identifier!r}" if identifier else "missing employee")
+                continue
+            try:
+                moment = _parse_moment(record.get('timestamp') or '')
+            except ValueError:
+                result.error(label, f"invalid timestamp {record.get('timestamp')!r}")
+                continue
+            direction = str(record.get('direction') or '').strip().lower()
+            if direction not in _DIRECTIONS:
+                result.error(label, f"invalid direction {direction!r} (in or out)")
+                continue
+            result.add(employee_id, moment, _DIRECTIONS[direction])
+    return result
+
+
+def _existing_days(company, days):
+    """The (employee_id, date) of `days` that already have an attendance record."""
+    dates = [date for _, date in days]
+    employee_ids = sorted({employee_id for employee_id, _ in days})
+    existing = set()
+    for chunk in _chunks(employee_ids, 500):
+        existing.update(
+            Attendance._base_manager.filter(
+                company=company, employee_id__in=chunk, date__range=(min(dates), max(dates)),
+            ).values_list('employee_id', 'date')
+        )
+    return existing & set(days)
+
+
+def import_punches(lines, company, file_format='csv'):
+    """
+    Imports a punch file (see read_punches) into attendance records of
+    `company`. Nothing is written if any punch is invalid; the returned
+    PunchImport lists the errors or counts the records created and the
+    days skipped because they were already recorded, with warnings for the
+    punches that could not be recorded.
+    """
+    result = read_punches(lines, company, file_format)
+    if result.error_count:
+        return result
+    times = result.check_times()
+    if not times:
+        return result
+
+    existing = _existing_days(company, times)
+    result.duplicates = len(existing)
+    records = (record for record in result.records(company, times) if (record.employee_id, record.date) not in existing)
+    with transaction.atomic():
+        for batch in _chunks(records, BATCH_SIZE):
+            Attendance.objects.bulk_create(batch)
+            result.created += len(batch)
+        if result.created:
+            days = [day for day in times if day not in existing]
+            attendance_imported.send(
+                sender=Attendance, company_id=company.id,
+                employee_ids=sorted({employee_id for employee_id, _ in days}),
+                start_date=min(date for _, date in days), end_date=max(date for _, date in days),
+            )
+    return result
@@ -0,0 +1,158 @@
+"""
+Employee search.
+
+On SQLite, employees are indexed in an FTS5 table (hr_employee_search,
+created by migration 0006) holding their name, email, department, position
+and a tenant token, so searching never scans the employee table. Saving or
+deleting an employee, department or position updates it (hr.signals).
+bulk_create() and queryset update() send no signals: code writing
+employees that way calls index_employees() itself, and
+rebuild_search_index (the management command) refills the whole index.
+The index lives in the same database, so it follows transactions.
+
+Every word typed must match as a prefix. A first, bounded query counts the
+matches: up to SEARCH_RANK_CAP of them are ranked with bm25 (name first,
+then email, then department and position). Broader searches (a letter or a
+common surname) return name matches first, then the other ones, in index
+order, so the work stays bounded by SEARCH_LIMIT whatever the headcount.
+
+Other databases, or a SQLite build without FTS5, fall back to the
+case-insensitive OR of the same fields.
+"""
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, When
+
+SEARCH_TABLE = 'hr_employee_search'
+# Columns searched for the words typed; tenant only restricts the company
+CONTENT_COLUMNS = ('name', 'email', 'department', 'position')
+# Matches returned; searches are meant to narrow down, not to page through
+SEARCH_LIMIT = 200
+# Searches with at most this many matches are ranked with bm25
+SEARCH_RANK_CAP = 500
+# bm25 weights of the name, email, department, position and tenant columns
+RANK_WEIGHTS = (10.0, 5.0, 2.0, 2.0, 0.0)
+
+_available = {}
+
+
+def search_available(using='default'):
+    """Whether the FTS5 index exists on this database (checked once per process)."""
+    if using not in _available:
+        connection = connections[using]
+        _available[using] = (
+            connection.vendor == 'sqlite'
+            and SEARCH_TABLE in connection.introspection.table_names()
+        )
+    return _available[using]
+
+
+def fts_query(text):
+    """FTS5 query for free text: every word, as a quoted prefix, must match."""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term.strip('"'))
+
+
+def search_employee_ids(text, company_id=None, limit=SEARCH_LIMIT, using='default'):
+    """Ids of the best `limit` matches of `text`, best first."""
+    terms = fts_query(text)
+    if not terms:
+        return []
+    # The words only search the content columns: a prefix of the tenant
+    # token ("c", "c1") would otherwise match the whole company
+    tenant = f'tenant : c{int(company_id)} AND ' if company_id is not None else ''
+    everywhere = f'{tenant}{{{" ".join(CONTENT_COLUMNS)}}} : ({terms})'
+    match = f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s'
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'{match} LIMIT %s', [everywhere, SEARCH_RANK_CAP + 1])
+        if len(cursor.fetchall()) <= SEARCH_RANK_CAP:
+            weights = ', '.join(map(str, RANK_WEIGHTS))
+            cursor.execute(f'{match} ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT %s', [everywhere, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+        ids = []
+        for query in (f'{tenant}name : ({terms})', everywhere):
+            cursor.execute(f'{match} LIMIT %s', [query, limit * 2])
+            ids.extend(row[0] for row in cursor.fetchall() if row[0] not in ids)
+            if len(ids) >= limit:
+                break
+        return ids[:limit]
+
+
+def search_employees(queryset, text, company_id=None):
+    """
+    `queryset` (of Employee) narrowed to the matches of `text`, best first
+    with the index, by last name with the fallback.
+    """
+    if not search_available(queryset.db):
+        return queryset.filter(
+            Q(first_name__icontains=text)
+            | Q(last_name__icontains=text)
+            | Q(email__icontains=text)
+            | Q(department__name__icontains=text)
+            | Q(position__title__icontains=text)
+        ).order_by('last_name', 'id')
+
+    ids = search_employee_ids(text, company_id, using=queryset.db)
+    if not ids:
+        return queryset.none()
+    rank = Case(*[When(id=pk, then=position) for position, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(id__in=ids).annotate(search_rank=rank).order_by('search_rank')
+
+
+def _in(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def index_employees(employee_ids, using='default'):
+    """(Re)indexes employees, e.g. after bulk_create() or update()."""
+    if not search_available(using):
+        return
+    employee_ids = list(employee_ids)
+    with connections[using].cursor() as cursor:
+        for i in range(0, len(employee_ids), 500):
+            chunk = employee_ids[i:i + 500]
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({_in(chunk)})', chunk)
+            cursor.execute(f'{INDEX_ALL_SQL} WHERE e.id IN ({_in(chunk)})', chunk)
+
+
+def unindex_employees(employee_ids, using='default'):
+    if not search_available(using):
+        return
+    employee_ids = list(employee_ids)
+    with connections[using].cursor() as cursor:
+        for i in range(0, len(employee_ids), 500):
+            chunk = employee_ids[i:i + 500]
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({_in(chunk)})', chunk)
+
+
+def relabel_employees(column, foreign_key, related_id, label, using='default'):
+    """Sets the department or position `column` of the employees whose `foreign_key` is `related_id`."""
+    if not search_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {SEARCH_TABLE} SET {column} = %s '
+            f'WHERE rowid IN (SELECT id FROM hr_employee WHERE {foreign_key} = %s)',
+            [label, related_id],
+        )
+
+
+def rebuild_search_index(using='default'):
+    """Refills the index from the employee table, e.g. after restoring a dump."""
+    if not search_available(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(INDEX_ALL_SQL)
+        return cursor.rowcount
+
+
+INDEX_ALL_SQL = f"""
+INSERT INTO {SEARCH_TABLE} (rowid, name, email, department, position, tenant)
+SELECT e.id, e.first_name || ' ' || e.last_name, e.email,
+       COALESCE(d.name, ''), COALESCE(p.title, ''), 'c' || e.company_id
+FROM hr_employee e
+LEFT JOIN hr_department d ON d.id = e.department_id
+LEFT JOIN hr_position p ON p.id = e.position_id
+"""
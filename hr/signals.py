@@ -0,0 +1,43 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from .models import Department, Employee, Position
+from .search import index_employees, relabel_employees, unindex_employees
+
+# Sent after attendance records are written in bulk (bulk_create sends no
+# post_save), with company_id, employee_ids, start_date and end_date.
+attendance_imported = Signal()
+
+
+# Employee search index (hr/search.py)
+
+@receiver(post_save, sender=Employee)
+def employee_saved(sender, instance, using, **kwargs):
+    index_employees([instance.pk], using)
+
+
+@receiver(post_delete, sender=Employee)
+def employee_deleted(sender, instance, using, **kwargs):
+    unindex_employees([instance.pk], using)
+
+
+@receiver(post_save, sender=Department)
+def department_saved(sender, instance, using, created=False, **kwargs):
+    if not created:
+        relabel_employees('department', 'department_id', instance.pk, instance.name, using)
+
+
+@receiver(pre_delete, sender=Department)
+def department_deleted(sender, instance, using, **kwargs):
+    # Its employees are set to no department with a plain UPDATE
+    relabel_employees('department', 'department_id', instance.pk, '', using)
+
+
+@receiver(post_save, sender=Position)
+def position_saved(sender, instance, using, created=False, **kwargs):
+    if not created:
+        relabel_employees('position', 'position_id', instance.pk, instance.title, using)
+
+
+@receiver(pre_delete, sender=Position)
+def position_deleted(sender, instance, using, **kwargs):
+    relabel_employees('position', 'position_id', instance.pk, '', using)
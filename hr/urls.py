@@ -12,6 +12,7 @@ urlpatterns = [
     path('documents/<int:pk>/delete/', views.EmployeeDocumentDeleteView.as_view(), name='document_delete'),
     path('attendance/', views.attendance_list, name='attendance_list'),
     path('attendance/add/', views.AttendanceCreateView.as_view(), name='attendance_add'),
+    path('attendance/import/', views.attendance_import, name='attendance_import'),
     path('attendance/<int:pk>/edit/', views.AttendanceUpdateView.as_view(), name='attendance_edit'),
     path('attendance/<int:pk>/delete/', views.AttendanceDeleteView.as_view(), name='attendance_delete'),
     
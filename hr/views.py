@@ -1,31 +1,57 @@
 
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
-from django.db.models import Q
 from .models import Employee, Attendance, Department, Position, LeaveRequest
-from .forms import EmployeeForm, DepartmentForm, PositionForm, LeaveRequestForm, AttendanceForm
+from .forms import EmployeeForm, DepartmentForm, PositionForm, LeaveRequestForm, AttendanceForm, AttendanceFilterForm, PunchUploadForm
 from core.decorators import hr_admin_required
+from core.pagination import capped_count, keyset_page
+from core.utils import get_current_company
+from .search import SEARCH_LIMIT, search_employees
+from .punches import import_punches
+import csv
+import io
 
 class EmployeeListView(LoginRequiredMixin, ListView):
     model = Employee
     template_name = 'hr/employee_list.html'
     context_object_name = 'employees'
-    paginate_by = 10
+    paginate_by = 50
+    count_cap = 1000
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        query = self.request.GET.get('q')
+        queryset = super().get_queryset().select_related('position', 'department')
+        query = self.request.GET.get('q', '').strip()
         if query:
-            queryset = queryset.filter(
-                Q(first_name__icontains=query) | 
-                Q(last_name__icontains=query) |
-                Q(email__icontains=query)
-            )
-        return queryset.order_by('last_name')
+            # Ranked, from the search index (hr/search.py)
+            company = get_current_company()
+            return search_employees(queryset, query, company.id if company else None)
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        # Keyset pagination: the cursor is the last row shown, so a deep
+        # page costs what the first one does. Search results keep their
+        # rank; the plain list is covered by the (company, last_name, id) index
+        ordering = ['search_rank', 'id'] if 'search_rank' in queryset.query.annotations else ['last_name', 'id']
+        try:
+            page = keyset_page(queryset, ordering, self.request.GET.get('after'), page_size)
+        except ValueError:
+            # A stale or tampered link: start over
+            page = keyset_page(queryset, ordering, None, page_size)
+        return None, page, page.items, page.has_next
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['employee_count'] = capped_count(self.object_list, self.count_cap)
+        context['count_cap'] = self.count_cap
+        # Searches return the best SEARCH_LIMIT matches only
+        context['search_limited'] = bool(self.request.GET.get('q', '').strip()) and context['employee_count'] >= SEARCH_LIMIT
+        context['search_limit'] = SEARCH_LIMIT
+        return context
 
 class EmployeeCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     model = Employee
@@ -160,10 +186,59 @@ class PositionDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return self.request.user.is_hr_admin
 
+ATTENDANCE_PAGE_SIZE = 50
+ATTENDANCE_COUNT_CAP = 1000
+# Covered by the (company, date) index; the id breaks ties between punches of a day
+ATTENDANCE_ORDERING = ['-date', '-id']
+
 @login_required
 def attendance_list(request):
-    attendance = Attendance.objects.all().order_by('-date')
-    return render(request, 'hr/attendance_list.html', {'attendance': attendance})
+    """
+    Attendance records, newest first, filtered by date range, employee and
+    department, and paginated by keyset so a page costs the same however
+    long the history.
+    """
+    form = AttendanceFilterForm(request.GET or None)
+    employees_limited = False
+    attendance = Attendance.objects.select_related('employee__department')
+    if form.is_bound and form.is_valid():
+        filters = form.cleaned_data
+        if filters['date_from']:
+            attendance = attendance.filter(date__gte=filters['date_from'])
+        if filters['date_to']:
+            attendance = attendance.filter(date__lte=filters['date_to'])
+        if filters['department']:
+            attendance = attendance.filter(employee__department=filters['department'])
+        if filters['employee'].strip():
+            company = get_current_company()
+            employees = search_employees(Employee.objects.all(), filters['employee'].strip(), company.id if company else None)
+            # A list, not a subquery, so the (employee, date) index is used
+            # instead of walking the whole history for a few employees
+            employee_ids = list(employees.values_list('id', flat=True)[:SEARCH_LIMIT])
+            # Searches return the best SEARCH_LIMIT matches only
+            employees_limited = len(employee_ids) >= SEARCH_LIMIT
+            attendance = attendance.filter(employee_id__in=employee_ids)
+    elif form.is_bound:
+        attendance = attendance.none()
+
+    try:
+        page = keyset_page(attendance, ATTENDANCE_ORDERING, request.GET.get('after'), ATTENDANCE_PAGE_SIZE)
+    except ValueError:
+        # A stale or tampered link: start over
+        page = keyset_page(attendance, ATTENDANCE_ORDERING, None, ATTENDANCE_PAGE_SIZE)
+    # The filters, carried over by the pagination links
+    filter_query = request.GET.copy()
+    filter_query.pop('after', None)
+    return render(request, 'hr/attendance_list.html', {
+        'form': form,
+        'filter_query': filter_query.urlencode(),
+        'attendance': page,
+        'page': page,
+        'record_count': capped_count(attendance, ATTENDANCE_COUNT_CAP),
+        'count_cap': ATTENDANCE_COUNT_CAP,
+        'employees_limited': employees_limited,
+        'search_limit': SEARCH_LIMIT,
+    })
 
 # --- Leave Management Views ---
 class LeaveRequestListView(LoginRequiredMixin, ListView):
@@ -245,6 +320,53 @@ class AttendanceDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return self.request.user.is_hr_admin
 
+@hr_admin_required
+def attendance_import(request):
+    """
+    Upload of a time-clock punch file (see hr/punches.py). Nothing is saved
+    unless every punch is valid.
+    """
+    form = PunchUploadForm()
+    errors, error_count = [], 0
+    company = get_current_company() or request.user.company
+    if request.method == 'POST':
+        form = PunchUploadForm(request.POST, request.FILES)
+        if company is None:
+            # Superusers without a company: punches must belong to a tenant
+            errors = ["Your account has no company to import the punches into."]
+        elif form.is_valid():
+            lines = io.TextIOWrapper(form.cleaned_data['punch_file'].file, encoding='utf-8-sig', newline='')
+            try:
+                result = import_punches(lines, company, form.file_format)
+            except UnicodeDecodeError:
+                errors = ["The file is not UTF-8 encoded."]
+            except (ValueError, csv.Error) as exc:
+                errors = [f"Unreadable file: {exc}"]
+            else:
+                errors, error_count = result.errors, result.error_count
+                if not errors:
+                    messages.success(
+                        request,
+                        f"Imported {result.punches} punches: {result.created} attendance records created, "
+                        f"{result.duplicates} days already recorded were skipped."
+                    )
+                    if result.warning_count:
+                        more = result.warning_count - len(result.warnings)
+                        messages.warning(
+                            request,
+                            f"{result.warning_count} punches were not recorded: " + "; ".join(result.warnings)
+                            + (f"; and {more} more." if more else "."),
+                        )
+                    return redirect('attendance_list')
+        else:
+            errors = [error for field_errors in form.errors.values() for error in field_errors]
+
+    return render(request, 'hr/attendance_import.html', {
+        'form': form,
+        'errors': errors,
+        'more_errors': error_count - len(errors),
+    })
+
 # --- Timeclock Views ---
 @login_required
 def clock_in(request):
@@ -0,0 +1,250 @@
+"""
+Bank disbursement files of a processed payroll period.
+
+Every payslip with a positive net pay becomes one transfer to the employee's
+bank_account. Transfers are split by bank, taken as the first four digits of
+the account number (the bank code of a 20-digit account), into one file per
+bank, and every file ends with control totals: number of transfers, total
+amount and a hash total of the account numbers.
+
+Rows are read in chunks ordered by bank code, so each bank file is written
+from start to finish before the next one begins. The files go out one after
+another in a streamed ZIP (see payroll.exports.ZipStream). A control.csv
+with the totals of every file comes last. Transfers whose account is not
+4 to 34 digits (dashes and spaces aside) are left out of every bank file
+and listed in exceptions.csv instead, for manual handling; a truncated or
+empty account must never reach a payment file.
+
+Fixed-width layout, 120 characters per record, CRLF line endings:
+
+    H  1-1   'H'               D  1-1   'D'               T  1-1   'T'
+       2-5   bank code            2-35  account number       2-9   transfers
+       6-13  payment YYYYMMDD     36-50 amount in cents      10-27 total in cents
+      14-53  company name         51-60 employee id          28-45 account hash
+      54-73  batch reference      61-100 employee name
+                                  101-120 reference
+
+Text is upper case ASCII, numbers are zero-filled on the left and text is
+space-filled on the right.
+"""
+import csv
+import io
+import unicodedata
+import zipfile
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Replace, Substr
+from .exports import ZipStream
+
+RECORD_LENGTH = 120
+LINE_END = '\r\n'
+BANK_FILE_FORMATS = ('fixed', 'csv')
+CHUNK_SIZE = 2000
+HASH_MODULUS = 10 ** 18
+UNKNOWN_BANK = '0000'
+ACCOUNT_DIGITS = (4, 34)
+
+
+def _ascii(text, width):
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode()
+    return text.upper()[:width].ljust(width)
+
+
+def _number(value, width):
+    text = str(value)
+    if len(text) > width:
+        raise ValueError(f"{value} does not fit in {width} digits")
+    return text.zfill(width)
+
+
+def _record(*fields):
+    return ''.join(fields).ljust(RECORD_LENGTH) + LINE_END
+
+
+def _digits(account):
+    return ''.join(ch for ch in account or '' if ch.isdigit())
+
+
+def _cents(amount):
+    return int(amount * 100)
+
+
+def _amount(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def account_error(account):
+    """Why `account` cannot be paid to, or None."""
+    cleaned = (account or '').replace('-', '').replace(' ', '')
+    if not cleaned:
+        return "no bank account"
+    if not cleaned.isdigit():
+        return "bank account is not all digits"
+    if not ACCOUNT_DIGITS[0] <= len(cleaned) <= ACCOUNT_DIGITS[1]:
+        return f"bank account is not {ACCOUNT_DIGITS[0]} to {ACCOUNT_DIGITS[1]} digits"
+    return None
+
+
+class BankBatch:
+    """Control totals of one bank's file."""
+
+    def __init__(self, bank_code):
+        self.bank_code = bank_code
+        self.count = 0
+        self.total_cents = 0
+        self.account_hash = 0
+
+    def add(self, account, cents):
+        self.count += 1
+        self.total_cents += cents
+        self.account_hash = (self.account_hash + int(account or 0)) % HASH_MODULUS
+
+
+def disbursement_rows(payslips):
+    """
+    (bank_code, account, net_pay, employee_id, first_name, last_name,
+    payslip_id) of every payslip to be paid, ordered by bank then employee.
+    """
+    account = Replace(Replace(F('employee__bank_account'), Value('-'), Value('')), Value(' '), Value(''))
+    return (
+        payslips.filter(net_pay__gt=0)
+        .annotate(account_prefix=Substr(account, 1, 4))
+        .annotate(bank_code=Case(
+            When(account_prefix__regex=r'^[0-9]{4}$', then=F('account_prefix')),
+            default=Value(UNKNOWN_BANK),
+        ))
+        .order_by('bank_code', 'employee_id')
+        .values_list(
+            'bank_code', 'employee__bank_account', 'net_pay', 'employee_id',
+            'employee__first_name', 'employee__last_name', 'id',
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+class _FixedWidthWriter:
+    extension = 'txt'
+
+    def __init__(self, period, company_name, reference):
+        self.period = period
+        self.company_name = company_name
+        self.reference = reference
+
+    def header(self, batch):
+        return _record(
+            'H', _number(batch.bank_code, 4), self.period.end_date.strftime('%Y%m%d'),
+            _ascii(self.company_name, 40), _ascii(self.reference, 20),
+        )
+
+    def detail(self, account, cents, employee_id, name, payslip_id):
+        return _record(
+            'D', account.ljust(34), _number(cents, 15), _number(employee_id, 10),
+            _ascii(name, 40), _ascii(f'PAYSLIP{payslip_id}', 20),
+        )
+
+    def trailer(self, batch):
+        return _record(
+            'T', _number(batch.count, 8), _number(batch.total_cents, 18), _number(batch.account_hash, 18),
+        )
+
+
+class _CSVWriter:
+    extension = 'csv'
+
+    def __init__(self, period, company_name, reference):
+        self.period = period
+        self.company_name = company_name
+        self.reference = reference
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator=LINE_END)
+
+    def _line(self, *fields):
+        self.writer.writerow(fields)
+        line = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return line
+
+    def header(self, batch):
+        return self._line('record', 'account', 'amount', 'employee_id', 'name', 'reference')
+
+    def detail(self, account, cents, employee_id, name, payslip_id):
+        return self._line('D', account, _amount(cents), employee_id, name, f'PAYSLIP{payslip_id}')
+
+    def trailer(self, batch):
+        return self._line('T', batch.count, _amount(batch.total_cents), '', '', batch.account_hash)
+
+
+def bank_file_name(period, bank_code, extension):
+    return f'bank_{bank_code}_{period.end_date:%Y%m%d}_{period.id}.{extension}'
+
+
+def stream_bank_files(period, payslips, file_format='fixed', company_name=None, reference=None):
+    """
+    Yields a ZIP with one disbursement file per bank (`file_format` 'fixed'
+    or 'csv') for `payslips` of `period`, followed by control.csv and, when
+    some accounts cannot be paid to, exceptions.csv.
+    """
+    writer_class = _CSVWriter if file_format == 'csv' else _FixedWidthWriter
+    reference = reference or f'PAYROLL{period.end_date:%Y%m}{period.id}'
+    writer = writer_class(period, company_name or period.company.name, reference)
+    batches = []
+    exceptions = []
+    stream = ZipStream()
+
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        current, bank_file, pending = None, None, []
+
+        def close_file():
+            pending.append(writer.trailer(current))
+            bank_file.write(''.join(pending).encode())
+            bank_file.close()
+            pending.clear()
+
+        for bank_code, account, net_pay, employee_id, first_name, last_name, payslip_id in disbursement_rows(payslips):
+            error = account_error(account)
+            if error:
+                exceptions.append([payslip_id, employee_id, f'{last_name} {first_name}', account, net_pay, error])
+                continue
+            if current is None or bank_code != current.bank_code:
+                if current is not None:
+                    close_file()
+                    yield stream.drain()
+                current = BankBatch(bank_code)
+                batches.append(current)
+                bank_file = archive.open(bank_file_name(period, bank_code, writer.extension), 'w', force_zip64=True)
+                pending.append(writer.header(current))
+
+            account = _digits(account)
+            cents = _cents(net_pay)
+            current.add(account, cents)
+            pending.append(writer.detail(account, cents, employee_id, f'{last_name} {first_name}', payslip_id))
+            if len(pending) >= 500:
+                bank_file.write(''.join(pending).encode())
+                pending.clear()
+                yield stream.drain()
+
+        if current is not None:
+            close_file()
+
+        control = io.StringIO()
+        control_writer = csv.writer(control)
+        control_writer.writerow(['file', 'bank_code', 'transfers', 'total', 'account_hash'])
+        for batch in batches:
+            control_writer.writerow([
+                bank_file_name(period, batch.bank_code, writer.extension), batch.bank_code,
+                batch.count, _amount(batch.total_cents), batch.account_hash,
+            ])
+        control_writer.writerow([
+            'TOTAL', '', sum(batch.count for batch in batches),
+            _amount(sum(batch.total_cents for batch in batches)),
+            sum(batch.account_hash for batch in batches) % HASH_MODULUS,
+        ])
+        archive.writestr('control.csv', control.getvalue())
+
+        if exceptions:
+            listing = io.StringIO()
+            listing_writer = csv.writer(listing)
+            listing_writer.writerow(['payslip_id', 'employee_id', 'name', 'bank_account', 'net_pay', 'reason'])
+            listing_writer.writerows(exceptions)
+            archive.writestr('exceptions.csv', listing.getvalue())
+    yield stream.drain()
@@ -0,0 +1,267 @@
+"""
+Synthetic tenants and timings for the payroll benchmark suite.
+
+build_synthetic_tenant() creates a company of a given headcount with a month
+of attendance, some leave, salary rules (global and assigned) and a
+progressive tax table, using bulk inserts and a fixed random seed so every
+run benchmarks the same data. Tenants are named bench-<size>-<seed> and
+reused when they already exist.
+
+run_benchmarks() times the payroll entry points against a tenant and returns
+one result per target: wall time, query count and peak Python memory (from
+tracemalloc). Each target runs once, so all three figures come from the same
+cold run; tracing slows it down, so compare timings taken with memory=False.
+
+See the benchmark_payroll management command.
+"""
+import calendar
+import random
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from django.db import connection, transaction
+from django.test import RequestFactory
+from core.models import Company, User
+from core.utils import set_current_company, remove_current_company
+from hr.models import Attendance, Department, Employee, LeaveRequest, Position
+from hr.search import index_employees
+from .models import PayrollPeriod, SalaryRule, TaxBracket
+
+DEPARTMENTS = ['Engineering', 'Sales', 'Operations', 'Finance', 'Support', 'Marketing', 'Legal', 'People']
+POSITIONS = ['Associate', 'Specialist', 'Lead']
+FIRST_NAMES = ['Ana', 'Luis', 'Maria', 'Jose', 'Carmen', 'Pedro', 'Sofia', 'Diego', 'Lucia', 'Andres']
+LAST_NAMES = ['Garcia', 'Rodriguez', 'Lopez', 'Perez', 'Gonzalez', 'Sanchez', 'Ramirez', 'Torres', 'Flores', 'Rivera']
+
+
+def _month_period(start):
+    last_day = calendar.monthrange(start.year, start.month)[1]
+    return start.replace(day=1), start.replace(day=last_day)
+
+
+def build_synthetic_tenant(size, month=date(2024, 1, 1), seed=0, batch_size=5000):
+    """
+    Returns (company, period) for a tenant of `size` active employees built
+    from `seed`, creating it on first use. Everything is written in one
+    transaction, so an interrupted build leaves nothing behind.
+    """
+    slug = f'bench-{size}-{seed}'
+    start_date, end_date = _month_period(month)
+    company = Company.objects.filter(slug=slug).first()
+    if company:
+        period = PayrollPeriod._base_manager.get(company=company, start_date=start_date)
+        return company, period
+
+    rng = random.Random(f'{seed}-{size}')
+    with transaction.atomic():
+        company = Company.objects.create(name=f'Benchmark {size} (seed {seed})', slug=slug)
+        period = PayrollPeriod.objects.create(company=company, start_date=start_date, end_date=end_date)
+
+        departments = Department.objects.bulk_create(
+            [Department(company=company, name=name) for name in DEPARTMENTS]
+        )
+        positions = Position.objects.bulk_create([
+            Position(company=company, department=department, title=f'{department.name} {title}')
+            for department in departments for title in POSITIONS
+        ])
+
+        employees = []
+        for i in range(size):
+            position = rng.choice(positions)
+            employees.append(Employee(
+                company=company,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=f'{rng.choice(LAST_NAMES)}{i % 97}',
+                email=f'{slug}-{i}@example.com',
+                department_id=position.department_id,
+                position=position,
+                hire_date=start_date - timedelta(days=rng.randint(30, 3650)),
+                salary=Decimal(rng.randint(120000, 1500000)) / 100,
+                bank_account=f'{rng.choice(["0102", "0105", "0108", "0134"])}{i:016d}',
+                contract_type=rng.choices(['FULL_TIME', 'PART_TIME', 'CONTRACTOR'], [85, 10, 5])[0],
+            ))
+        employees = Employee.objects.bulk_create(employees, batch_size=batch_size)
+        # bulk_create sends no post_save
+        index_employees([employee.id for employee in employees])
+
+        workdays = [
+            start_date + timedelta(days=offset)
+            for offset in range((end_date - start_date).days + 1)
+            if (start_date + timedelta(days=offset)).weekday() < 5
+        ]
+
+        # About 8% of employees take a few days of leave; approved days off
+        # have no punches.
+        leaves, days_off = [], {}
+        for employee in employees:
+            if rng.random() >= 0.08:
+                continue
+            first = rng.choice(workdays)
+            last = min(end_date, first + timedelta(days=rng.randint(0, 4)))
+            status = rng.choices(['APPROVED', 'PENDING', 'REJECTED'], [70, 20, 10])[0]
+            leaves.append(LeaveRequest(
+                company=company, employee=employee, start_date=first, end_date=last,
+                leave_type=rng.choice(['VACATION', 'SICK', 'OTHER']), status=status,
+            ))
+            if status == 'APPROVED':
+                days_off[employee.id] = (first, last)
+        LeaveRequest.objects.bulk_create(leaves, batch_size=batch_size)
+
+        # One punch per workday: in between 7:30 and 9:30, shifts of 7.5 to
+        # 10 hours, a few absences and a few punches left open.
+        punches = []
+        for employee in employees:
+            leave = days_off.get(employee.id)
+            for day in workdays:
+                if leave and leave[0] <= day <= leave[1]:
+                    continue
+                if rng.random() < 0.03:
+                    continue
+                check_in = datetime.combine(day, datetime.min.time()) + timedelta(minutes=450 + rng.randint(0, 120))
+                check_out = check_in + timedelta(minutes=rng.randint(450, 600))
+                punches.append(Attendance(
+                    company=company, employee=employee, date=day, check_in=check_in.time(),
+                    check_out=None if rng.random() < 0.005 else check_out.time(),
+                ))
+                if len(punches) >= batch_size:
+                    Attendance.objects.bulk_create(punches)
+                    punches = []
+        Attendance.objects.bulk_create(punches)
+
+        SalaryRule.objects.create(company=company, name='Food Allowance', rule_type='ALLOWANCE', amount=Decimal('50.00'))
+        SalaryRule.objects.create(company=company, name='Housing Allowance', rule_type='ALLOWANCE', percentage=Decimal('2.50'))
+        SalaryRule.objects.create(company=company, name='Social Security', rule_type='DEDUCTION', percentage=Decimal('4.00'))
+        night_shift = SalaryRule.objects.create(
+            company=company, name='Night Shift Bonus', rule_type='ALLOWANCE', amount=Decimal('120.00'), is_global=False
+        )
+        union_dues = SalaryRule.objects.create(
+            company=company, name='Union Dues', rule_type='DEDUCTION', percentage=Decimal('1.00'), is_global=False
+        )
+        through = SalaryRule.assigned_employees.through
+        through.objects.bulk_create(
+            [through(salaryrule=night_shift, employee=e) for e in employees if rng.random() < 0.15]
+            + [through(salaryrule=union_dues, employee=e) for e in employees if rng.random() < 0.30],
+            batch_size=batch_size,
+        )
+
+        # Each save recomputes the sustraendos of the whole table
+        # (rebuild_deductions, from the TaxBracket post_save signal)
+        for min_income, max_income, rate in [
+            ('0.00', '2000.00', '0.00'),
+            ('2000.01', '5000.00', '6.00'),
+            ('5000.01', '9000.00', '12.00'),
+            ('9000.01', '14000.00', '20.00'),
+            ('14000.01', None, '30.00'),
+        ]:
+            TaxBracket.objects.create(
+                company=company,
+                min_income=Decimal(min_income),
+                max_income=Decimal(max_income) if max_income else None,
+                tax_rate=Decimal(rate),
+            )
+
+        User.objects.create_user(username=f'{slug}-admin', company=company, role='ADMIN')
+
+    return company, period
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, memory=True):
+    """
+    Runs func() once and returns (wall_seconds, queries, peak_memory_bytes).
+    A second run would find caches warm and payslips already written, so
+    peak memory is traced on the timed run itself, or None without `memory`.
+    """
+    counter = _QueryCounter()
+    peak = None
+    if memory:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            func()
+        wall = time.perf_counter() - start
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return wall, counter.count, peak
+
+
+def benchmark_targets(company, period, calculator_sample=200, mode=None):
+    """(name, items, callable) for every entry point that is benchmarked."""
+    # Imported here: views pull in the whole URL/template stack
+    from hr.views import EmployeeListView
+    from .services import PayrollCalculator
+    from .tasks import process_bulk_payroll
+    from .views import payroll_dashboard, run_payroll
+
+    factory = RequestFactory()
+    user = User.objects.get(username=f'{company.slug}-admin')
+    sample = list(
+        Employee._base_manager.filter(company=company, is_active=True).order_by('id')[:calculator_sample]
+    )
+
+    def request(path):
+        req = factory.get(path)
+        req.user = user
+        return req
+
+    def calculator():
+        for employee in sample:
+            PayrollCalculator(employee, period).calculate_net_pay()
+
+    def bulk_task():
+        result = process_bulk_payroll(period.id, company.id, mode=mode, finalize=False)
+        if result.startswith('Error'):
+            raise RuntimeError(result)
+
+    def dashboard():
+        payroll_dashboard(request('/payroll/'))
+
+    def run_page():
+        run_payroll(request(f'/payroll/run/{period.id}/'), period_id=period.id)
+
+    def employee_list():
+        EmployeeListView.as_view()(request('/hr/employees/')).render()
+
+    return [
+        ('PayrollCalculator.calculate_net_pay', len(sample), calculator),
+        ('process_bulk_payroll', None, bulk_task),
+        ('payroll_dashboard', None, dashboard),
+        ('run_payroll', None, run_page),
+        ('EmployeeListView', None, employee_list),
+    ]
+
+
+def run_benchmarks(company, period, calculator_sample=200, mode=None, memory=True):
+    """Returns a list of result dicts, one per benchmarked target."""
+    headcount = Employee._base_manager.filter(company=company, is_active=True).count()
+    results = []
+    set_current_company(company)
+    try:
+        for name, items, func in benchmark_targets(company, period, calculator_sample, mode):
+            wall, queries, peak = measure(func, memory)
+            results.append({
+                'tenant': company.slug,
+                'employees': headcount,
+                'target': name,
+                'items': items if items is not None else headcount,
+                'wall_seconds': round(wall, 6),
+                'queries': queries,
+                'peak_memory_bytes': peak,
+            })
+            # The bulk task clears the tenant when it is done
+            set_current_company(company)
+    finally:
+        remove_current_company()
+    return results
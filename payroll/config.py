@@ -0,0 +1,136 @@
+"""
+Payroll configuration of a period: the salary rules and tax brackets in
+effect on the period's end date, frozen into PayrollPeriod.config_snapshot.
+
+load_period_config() builds the snapshot the first time a period is
+computed (three queries) and afterwards only reads it back from the period
+row, so recomputing a period, even one employee at a time, does not query
+rules or brackets again. The compiled RulePlan and TaxTable are also cached
+per process, keyed by the snapshot's token.
+
+Snapshots of open periods are dropped whenever rules or brackets change
+(see payroll/signals.py), so corrections still reach unprocessed periods.
+Processed periods keep theirs: recomputing them later uses the
+configuration they were paid with, whatever was edited since.
+"""
+import threading
+import uuid
+from decimal import Decimal
+from django.db import transaction
+from .models import EffectiveDatedQuerySet, PayrollPeriod, SalaryRule, TaxBracket
+from .rules import RulePlan
+from .tax import TaxTable
+
+_configs = {}
+_lock = threading.Lock()
+
+
+class PeriodConfig:
+    def __init__(self, rule_plan, tax_table):
+        self.rule_plan = rule_plan
+        self.tax_table = tax_table
+
+
+def _decimal(value):
+    return None if value is None else Decimal(value)
+
+
+def _string(value):
+    return None if value is None else str(value)
+
+
+def build_snapshot(company_id, as_of):
+    """JSON-ready rules, assignments and brackets of a company in effect on `as_of`."""
+    # Not the tenant-aware managers: this also runs outside requests
+    rules = list(EffectiveDatedQuerySet(SalaryRule).filter(company_id=company_id).effective_on(as_of))
+    assigned = {}
+    assignments = SalaryRule.assigned_employees.through.objects.filter(
+        salaryrule__in=[rule.id for rule in rules if not rule.is_global],
+    ).values_list('salaryrule_id', 'employee_id')
+    for rule_id, employee_id in assignments:
+        assigned.setdefault(rule_id, []).append(employee_id)
+    brackets = EffectiveDatedQuerySet(TaxBracket).filter(company_id=company_id).effective_on(as_of)
+
+    return {
+        'token': uuid.uuid4().hex,
+        'as_of': as_of.isoformat(),
+        'rules': [
+            {
+                'id': rule.id,
+                'name': rule.name,
+                'rule_type': rule.rule_type,
+                'amount': _string(rule.amount),
+                'percentage': _string(rule.percentage),
+                'is_global': rule.is_global,
+                'employees': sorted(assigned.get(rule.id, [])),
+            }
+            for rule in rules
+        ],
+        'brackets': [
+            {
+                'id': bracket.id,
+                'min_income': str(bracket.min_income),
+                'max_income': _string(bracket.max_income),
+                'tax_rate': str(bracket.tax_rate),
+                'deduction_amount': str(bracket.deduction_amount),
+            }
+            for bracket in brackets
+        ],
+    }
+
+
+def compile_snapshot(company_id, snapshot):
+    """PeriodConfig from a snapshot, with unsaved model instances as rules and brackets."""
+    rules, assignments = [], []
+    for row in snapshot['rules']:
+        rules.append(SalaryRule(
+            id=row['id'], company_id=company_id, name=row['name'], rule_type=row['rule_type'],
+            amount=_decimal(row['amount']), percentage=_decimal(row['percentage']),
+            is_global=row['is_global'],
+        ))
+        assignments.extend((row['id'], employee_id) for employee_id in row['employees'])
+    brackets = [
+        TaxBracket(
+            id=row['id'], company_id=company_id,
+            min_income=Decimal(row['min_income']), max_income=_decimal(row['max_income']),
+            tax_rate=Decimal(row['tax_rate']), deduction_amount=Decimal(row['deduction_amount']),
+        )
+        for row in snapshot['brackets']
+    ]
+    return PeriodConfig(RulePlan(rules, assignments), TaxTable(brackets))
+
+
+def load_period_config(period):
+    """The PeriodConfig of a period, snapshotting its configuration on first use."""
+    if period.config_snapshot is None:
+        with transaction.atomic():
+            # The period row is locked while the snapshot is built, so a rule
+            # or bracket change either commits first (and is in the snapshot)
+            # or waits in invalidate_open_snapshots() and drops it afterwards
+            stored = PayrollPeriod._base_manager.select_for_update().filter(pk=period.pk)
+            snapshot = stored.values_list('config_snapshot', flat=True).get()
+            if snapshot is None:
+                snapshot = build_snapshot(period.company_id, period.end_date)
+                # Only fills an empty snapshot, never one stored by another run
+                if not stored.filter(config_snapshot__isnull=True).update(config_snapshot=snapshot):
+                    snapshot = stored.values_list('config_snapshot', flat=True).get() or snapshot
+        period.config_snapshot = snapshot
+
+    token = period.config_snapshot['token']
+    cached = _configs.get(period.pk)
+    if cached and cached[0] == token:
+        return cached[1]
+
+    config = compile_snapshot(period.company_id, period.config_snapshot)
+    with _lock:
+        _configs[period.pk] = (token, config)
+    return config
+
+
+def invalidate_open_snapshots(company_id):
+    """Drops the snapshots of a company's unprocessed periods after a config change."""
+    # Empty snapshots are written too: the UPDATE then waits for a snapshot
+    # being built under the period lock (see load_period_config)
+    return PayrollPeriod._base_manager.filter(
+        company_id=company_id, is_processed=False,
+    ).update(config_snapshot=None)
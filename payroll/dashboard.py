@@ -0,0 +1,87 @@
+"""
+Tenant-level figures of the payroll dashboard, cached per company.
+
+dashboard_summary() costs three queries on a cache miss, whatever the
+number of periods: the open period and the last CHART_PERIODS processed ones,
+each joined to its PeriodSummary totals, and the active employee and
+department counts (one query with two subqueries). The result is stored in
+the default cache, shared by every process (see CACHES), and dropped by
+invalidate_dashboard(), called from the payslip, period, employee and
+department signals and from the bulk payslip writer, which sends no signals.
+A timeout bounds staleness from other bulk writes.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from core.models import Company
+from hr.models import Department, Employee
+from .models import PayrollPeriod
+
+CHART_PERIODS = 6
+
+
+def _cache_key(company_id):
+    return f'payroll:dashboard:{company_id or "all"}'
+
+
+def _count(queryset):
+    return Coalesce(
+        Subquery(queryset.order_by().values('company').annotate(n=Count('id')).values('n')[:1],
+                 output_field=IntegerField()),
+        0,
+    )
+
+
+def _total_cost(period):
+    summary = getattr(period, 'summary', None)
+    return summary.net_pay if summary else 0
+
+
+def _build_summary(company):
+    periods = PayrollPeriod.objects.defer('config_snapshot').select_related('summary')
+    # Open period: the first one created that is not processed yet
+    period = periods.filter(is_processed=False).order_by('id').first()
+    processed = list(periods.filter(is_processed=True).order_by('-end_date', 'id')[:CHART_PERIODS])[::-1]
+
+    if company is not None:
+        counts = (
+            Company.objects.filter(pk=company.pk)
+            .annotate(
+                active_employees=_count(Employee._base_manager.filter(company=OuterRef('pk'), is_active=True)),
+                department_count=_count(Department._base_manager.filter(company=OuterRef('pk'))),
+            )
+            .values('active_employees', 'department_count')
+            .get()
+        )
+    else:
+        counts = {
+            'active_employees': Employee.objects.filter(is_active=True).count(),
+            'department_count': Department.objects.count(),
+        }
+
+    return {
+        'period': period,
+        'total_cost': (_total_cost(period) or 0) if period else 0,
+        'active_employees': counts['active_employees'],
+        'department_count': counts['department_count'],
+        'chart_dates': [p.end_date.strftime("%b") for p in processed],
+        'chart_values': [float(_total_cost(p) or 0) for p in processed],
+    }
+
+
+def dashboard_summary(company):
+    """Cached dashboard figures of `company` (None: every tenant, as for superusers)."""
+    key = _cache_key(company.pk if company else None)
+    summary = cache.get(key)
+    if summary is None:
+        summary = _build_summary(company)
+        cache.set(key, summary, getattr(settings, 'PAYROLL_DASHBOARD_CACHE_TIMEOUT', 300))
+    return summary
+
+
+def invalidate_dashboard(company_id):
+    # After commit, so a concurrent request cannot cache the old figures again
+    keys = [_cache_key(company_id), _cache_key(None)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -1,11 +1,13 @@
 
+import csv
+import io
 from django import forms
 from .models import SalaryRule, TaxBracket
 
 class SalaryRuleForm(forms.ModelForm):
     class Meta:
         model = SalaryRule
-        fields = ['name', 'rule_type', 'amount', 'percentage', 'is_global', 'assigned_employees', 'description']
+        fields = ['name', 'rule_type', 'amount', 'percentage', 'is_global', 'assigned_employees', 'effective_from', 'effective_to', 'description']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
             'rule_type': forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
@@ -13,20 +15,86 @@ class SalaryRuleForm(forms.ModelForm):
             'percentage': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm', 'placeholder': '% of Base Salary'}),
             'is_global': forms.CheckboxInput(attrs={'class': 'h-4 w-4 text-indigo-600 focus:ring-indigo-500 border-gray-300 rounded'}),
             'assigned_employees': forms.SelectMultiple(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm', 'size': '5'}),
+            'effective_from': forms.DateInput(attrs={'type': 'date', 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
+            'effective_to': forms.DateInput(attrs={'type': 'date', 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
             'description': forms.Textarea(attrs={'rows': 3, 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
         }
 
 class TaxBracketForm(forms.ModelForm):
     class Meta:
         model = TaxBracket
-        fields = ['min_income', 'max_income', 'tax_rate', 'deduction_amount']
+        fields = ['min_income', 'max_income', 'tax_rate', 'deduction_amount', 'effective_from', 'effective_to']
         widgets = {
             'min_income': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
             'max_income': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm', 'placeholder': 'Leave empty for infinite'}),
             'tax_rate': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
             'deduction_amount': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm', 'placeholder': 'Auto-calculated if blank'}),
+            'effective_from': forms.DateInput(attrs={'type': 'date', 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
+            'effective_to': forms.DateInput(attrs={'type': 'date', 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm'}),
         }
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['deduction_amount'].required = False
+        # An automatic deduction shows blank, so saving the form keeps it automatic
+        if self.instance.pk and self.instance.deduction_is_auto:
+            self.initial['deduction_amount'] = None
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # A blank deduction means "calculate it"; any amount typed in,
+        # 0 included, is kept as it is
+        if cleaned_data.get('deduction_amount') is None:
+            cleaned_data['deduction_amount'] = 0
+            self.instance.deduction_is_auto = True
+        else:
+            self.instance.deduction_is_auto = False
+        return cleaned_data
+
+class BonusForm(forms.Form):
+    bonus = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+
+def parse_bonuses(rows):
+    """
+    Validates (label, payslip_id, bonus) rows, as read from a CSV upload or
+    from bonus-<payslip_id> fields. Returns ({payslip_id: Decimal}, errors).
+    """
+    bonuses, errors = {}, []
+    for label, payslip_id, value in rows:
+        try:
+            payslip_id = int(payslip_id)
+        except (TypeError, ValueError):
+            errors.append(f"{label}: invalid payslip id {payslip_id!r}")
+            continue
+        form = BonusForm({'bonus': (value or '').strip() or '0'})
+        if not form.is_valid():
+            errors.append(f"{label}: {' '.join(form.errors['bonus'])}")
+        elif payslip_id in bonuses:
+            errors.append(f"{label}: payslip {payslip_id} appears more than once")
+        else:
+            bonuses[payslip_id] = form.cleaned_data['bonus']
+    return bonuses, errors
+
+class BonusUploadForm(forms.Form):
+    csv_file = forms.FileField(
+        label="CSV file",
+        help_text="Columns payslip_id and bonus, e.g. the file from \"Download current bonuses\".",
+        widget=forms.ClearableFileInput(attrs={'accept': '.csv,text/csv', 'class': 'mt-1 block w-full text-sm text-gray-700'}),
+    )
+
+    def clean_csv_file(self):
+        upload = self.cleaned_data['csv_file']
+        try:
+            reader = csv.DictReader(io.TextIOWrapper(upload.file, encoding='utf-8-sig'))
+            if not {'payslip_id', 'bonus'} <= set(reader.fieldnames or []):
+                raise forms.ValidationError("The file needs payslip_id and bonus columns.")
+            bonuses, errors = parse_bonuses(
+                (f"Line {reader.line_num}", row['payslip_id'], row['bonus']) for row in reader
+            )
+        except UnicodeDecodeError:
+            raise forms.ValidationError("The file is not UTF-8 encoded CSV.")
+        except csv.Error as exc:
+            raise forms.ValidationError(f"Unreadable CSV: {exc}")
+        if errors:
+            raise forms.ValidationError(errors)
+        return bonuses
@@ -0,0 +1,120 @@
+"""
+Per-stage timing of payroll runs.
+
+A StageTimer adds up wall time, calls and database queries for each named
+stage of a run (attendance, hours, rules, tax, persistence...). Queries are
+counted with a single execute_wrapper installed by recording() and are
+charged to the stage that is open when they run, or to 'other'.
+
+Stages may nest (the tax table is loaded while payslips are saved, for
+instance). Time spent in an inner stage is charged to it alone and not to
+the stages around it, and re-entering the stage already open adds nothing,
+so the stages split the run: their seconds add up to at most its wall time.
+
+Instrumented code takes an optional timer and falls back to NULL_TIMER,
+whose stages are no-ops, so the hooks cost next to nothing when disabled.
+"""
+import csv
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from django.conf import settings
+from django.db import connection
+
+STAGE_FIELDS = ['stage', 'calls', 'seconds', 'queries']
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+        self.current = None
+        # [start, seconds spent in nested stages] of each open stage
+        self._open = []
+
+    def _entry(self, name):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {'calls': 0, 'seconds': 0.0, 'queries': 0}
+        return entry
+
+    def _count_query(self, execute, sql, params, many, context):
+        self._entry(self.current or 'other')['queries'] += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def recording(self):
+        """Counts the queries run on the default connection while open."""
+        with connection.execute_wrapper(self._count_query):
+            yield self
+
+    @contextmanager
+    def stage(self, name):
+        if name == self.current:
+            yield
+            return
+        outer, self.current = self.current, name
+        frame = [perf_counter(), 0.0]
+        self._open.append(frame)
+        try:
+            yield
+        finally:
+            self._open.pop()
+            elapsed = perf_counter() - frame[0]
+            entry = self._entry(name)
+            entry['seconds'] += elapsed - frame[1]
+            entry['calls'] += 1
+            if self._open:
+                self._open[-1][1] += elapsed
+            self.current = outer
+
+    def merge(self, stages):
+        """Adds the as_dict() of another timer, e.g. from a shard."""
+        for name, values in stages.items():
+            entry = self._entry(name)
+            for key in ('calls', 'seconds', 'queries'):
+                entry[key] += values.get(key, 0)
+
+    def as_dict(self):
+        return {
+            name: dict(values, seconds=round(values['seconds'], 6))
+            for name, values in self.stages.items()
+        }
+
+
+class NullTimer:
+    _stage = nullcontext()
+
+    def recording(self):
+        return nullcontext(self)
+
+    def stage(self, name):
+        return self._stage
+
+    def merge(self, stages):
+        pass
+
+    def as_dict(self):
+        return {}
+
+
+NULL_TIMER = NullTimer()
+
+
+def new_timer():
+    """A StageTimer if PAYROLL_STAGE_TIMINGS is on, else NULL_TIMER."""
+    if getattr(settings, 'PAYROLL_STAGE_TIMINGS', False):
+        return StageTimer()
+    return NULL_TIMER
+
+
+def write_timings_csv(jobs, out):
+    """One row per job and stage, for spotting a stage that regressed."""
+    writer = csv.writer(out)
+    writer.writerow(['job', 'period', 'status', 'started_at', 'processed'] + STAGE_FIELDS)
+    for job in jobs:
+        for name, values in sorted((job.timings or {}).items()):
+            writer.writerow([
+                job.id, job.period_id, job.status,
+                job.started_at.isoformat() if job.started_at else '',
+                job.processed, name,
+                values.get('calls', 0), values.get('seconds', 0), values.get('queries', 0),
+            ])
@@ -0,0 +1,194 @@
+"""
+Vectorized fixed-point payroll kernel.
+
+Computes the same figures as services.calculate_pay() for a whole column of
+employees at once, using NumPy int64 arrays instead of one Decimal per value.
+
+Every amount is kept as an exact mixed number: whole cents plus a remainder
+over a fixed denominator. The denominator only grows at the two places the
+Decimal path divides (overtime and percentages), so nothing is ever rounded
+until the final half-even rounding to cents, exactly like round(Decimal, 2).
+
+Headroom: salaries up to 10^8 (the DecimalField limit) and a full month of
+overtime keep every intermediate value well inside int64.
+"""
+from decimal import Decimal
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency, see requirements.txt
+    np = None
+
+# Overtime Pay (cents) = seconds * salary_cents * 1.5 / (3600 * 30 * 8)
+#                      = seconds * salary_cents / 576000
+OVERTIME_DENOMINATOR = 576000
+# Percentages and tax rates have two decimals: 15.25% -> 1525 / 10000
+PERCENT_SCALE = 10000
+
+
+def _to_int(value, places=2):
+    """Decimal with at most `places` decimals -> exact integer (e.g. cents)."""
+    scaled = Decimal(value).scaleb(places)
+    if scaled != scaled.to_integral_value():
+        raise ValueError(f"{value} has more than {places} decimal places")
+    return int(scaled)
+
+
+def _to_decimal(units, places=2):
+    return Decimal(int(units)).scaleb(-places)
+
+
+def _normalize(whole, frac, den):
+    carry, frac = np.divmod(frac, den)
+    return whole + carry, frac
+
+
+def _rescale(whole, frac, factor):
+    return whole, frac * factor
+
+
+def _mul_percent(whole, frac, den, percent):
+    """(whole + frac/den) * percent / 10000, returned over den * 10000."""
+    q, r = np.divmod(whole * percent, PERCENT_SCALE)
+    return _normalize(q, r * den + frac * percent, den * PERCENT_SCALE)
+
+
+def _round_half_even(whole, frac, den):
+    twice = frac * 2
+    up = (twice > den) | ((twice == den) & (whole % 2 == 1))
+    return whole + up.astype(np.int64)
+
+
+def calculate_pay_columns(salary, worked_seconds, overtime_seconds, rules, brackets):
+    """
+    Column version of services.calculate_pay().
+
+    salary: int64 array of cents. worked_seconds / overtime_seconds: int64 arrays.
+    rules: iterable of (is_allowance, amount_cents, percent, applies) where
+    percent is a percentage in hundredths (4.50% -> 450), zero meaning "not
+    set", and applies is a boolean mask of the employees the rule is assigned
+    to, or None for global rules.
+    brackets: iterable of (min_cents, max_cents or None, rate, deduction_cents),
+    ordered by min_cents, rate in hundredths of a percent.
+
+    Returns a dict of int64 arrays: money in cents, hours in hundredths.
+    """
+    n = len(salary)
+    zeros = np.zeros(n, dtype=np.int64)
+
+    # Overtime pay over OVERTIME_DENOMINATOR
+    overtime_whole, overtime_frac = np.divmod(overtime_seconds * salary, OVERTIME_DENOMINATOR)
+    gross_whole, gross_frac = salary + overtime_whole, overtime_frac
+    den = OVERTIME_DENOMINATOR
+
+    # Allowances & Deductions over den * PERCENT_SCALE
+    rule_den = den * PERCENT_SCALE
+    allowance_whole, allowance_frac = zeros.copy(), zeros.copy()
+    deduction_whole, deduction_frac = zeros.copy(), zeros.copy()
+    for is_allowance, amount_cents, percent, applies in rules:
+        if amount_cents:
+            whole, frac = np.full(n, amount_cents, dtype=np.int64), zeros
+        elif percent:
+            whole, frac = _mul_percent(gross_whole, gross_frac, den, percent)
+        else:
+            continue
+        if applies is not None:
+            whole, frac = np.where(applies, whole, 0), np.where(applies, frac, 0)
+        if is_allowance:
+            allowance_whole, allowance_frac = _normalize(allowance_whole + whole, allowance_frac + frac, rule_den)
+        else:
+            deduction_whole, deduction_frac = _normalize(deduction_whole + whole, deduction_frac + frac, rule_den)
+
+    total_whole, total_frac = _rescale(gross_whole, gross_frac, PERCENT_SCALE)
+    total_whole, total_frac = _normalize(total_whole + allowance_whole, total_frac + allowance_frac, rule_den)
+
+    # Tax over rule_den * PERCENT_SCALE. The first bracket (by min income)
+    # that contains the income wins, as in TaxTable.find().
+    tax_den = rule_den * PERCENT_SCALE
+    tax_whole, tax_frac = zeros.copy(), zeros.copy()
+    bracket_index = np.full(n, -1, dtype=np.int64)
+    brackets = list(brackets)
+    for index in range(len(brackets) - 1, -1, -1):
+        min_cents, max_cents, _rate, _deduction = brackets[index]
+        inside = total_whole >= min_cents
+        if max_cents is not None:
+            inside &= (total_whole < max_cents) | ((total_whole == max_cents) & (total_frac == 0))
+        bracket_index[inside] = index
+
+    for index, (_min, _max, rate, deduction_cents) in enumerate(brackets):
+        selected = bracket_index == index
+        if not selected.any():
+            continue
+        whole, frac = _mul_percent(total_whole[selected], total_frac[selected], rule_den, rate)
+        whole = whole - deduction_cents
+        negative = whole < 0
+        tax_whole[selected] = np.where(negative, 0, whole)
+        tax_frac[selected] = np.where(negative, 0, frac)
+
+    deductions_whole, deductions_frac = _rescale(deduction_whole, deduction_frac, PERCENT_SCALE)
+    deductions_whole, deductions_frac = _normalize(deductions_whole + tax_whole, deductions_frac + tax_frac, tax_den)
+
+    net_whole, net_frac = _rescale(total_whole, total_frac, PERCENT_SCALE)
+    net_whole, net_frac = _normalize(net_whole - deductions_whole, net_frac - deductions_frac, tax_den)
+
+    worked_whole, worked_frac = np.divmod(worked_seconds * 100, 3600)
+    overtime_hours_whole, overtime_hours_frac = np.divmod(overtime_seconds * 100, 3600)
+
+    return {
+        'gross_pay': _round_half_even(total_whole, total_frac, rule_den),
+        'total_deductions': _round_half_even(deductions_whole, deductions_frac, tax_den),
+        'net_pay': _round_half_even(net_whole, net_frac, tax_den),
+        'hours_worked': _round_half_even(worked_whole, worked_frac, 3600),
+        'overtime_hours': _round_half_even(overtime_hours_whole, overtime_hours_frac, 3600),
+        'overtime_pay': _round_half_even(overtime_whole, overtime_frac, OVERTIME_DENOMINATOR),
+    }
+
+
+def calculate_payslips(employees, attendance, rule_plan, tax_table):
+    """
+    Drop-in replacement for the per-employee loop in PayrollBatch.calculate().
+
+    employees: list of (employee_id, salary). attendance: {employee_id:
+    (worked_seconds, overtime_seconds)}. rule_plan: a payroll.rules.RulePlan.
+    tax_table: a payroll.tax.TaxTable.
+    Returns a list of (employee_id, data) with the same Decimal values
+    calculate_pay() would produce.
+    """
+    if np is None:
+        raise ImproperlyConfigured("The vectorized payroll kernel requires numpy (pip install numpy).")
+
+    employee_ids = [employee_id for employee_id, _salary in employees]
+    salary = np.array([_to_int(salary) for _id, salary in employees], dtype=np.int64)
+    seconds = [attendance.get(employee_id, (0, 0)) for employee_id in employee_ids]
+    worked_seconds = np.array([row[0] for row in seconds], dtype=np.int64)
+    overtime_seconds = np.array([row[1] for row in seconds], dtype=np.int64)
+
+    ids = np.array(employee_ids, dtype=np.int64)
+    rule_columns = [
+        (
+            rule.rule_type == 'ALLOWANCE',
+            _to_int(rule.amount) if rule.amount else 0,
+            _to_int(rule.percentage) if rule.percentage else 0,
+            None if rule.is_global else np.isin(ids, list(rule_plan.employees_by_rule[rule.id])),
+        )
+        for rule in rule_plan.rules
+        if rule.rule_type in ('ALLOWANCE', 'DEDUCTION')
+    ]
+    bracket_columns = [
+        (
+            _to_int(bracket.min_income),
+            _to_int(bracket.max_income) if bracket.max_income is not None else None,
+            _to_int(bracket.tax_rate),
+            _to_int(bracket.deduction_amount or 0),
+        )
+        for bracket in tax_table
+    ]
+
+    columns = calculate_pay_columns(salary, worked_seconds, overtime_seconds, rule_columns, bracket_columns)
+    columns = {key: values.tolist() for key, values in columns.items()}
+
+    return [
+        (employee_id, {key: _to_decimal(values[i]) for key, values in columns.items()})
+        for i, employee_id in enumerate(employee_ids)
+    ]
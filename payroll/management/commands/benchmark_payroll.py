@@ -0,0 +1,65 @@
+import json
+import platform
+from datetime import datetime, timezone
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from payroll.benchmarks import build_synthetic_tenant, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds synthetic tenants (bench-<size>-<seed>, reused when present) in the "
+        "configured database and times the payroll entry points against them. "
+        "Run it on a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+                            help="Headcounts of the synthetic tenants (default: 1000 10000 100000)")
+        parser.add_argument('--output', default='payroll_benchmark.json',
+                            help="JSON file the results are written to")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the generated data")
+        parser.add_argument('--calculator-sample', type=int, default=200,
+                            help="Employees run through PayrollCalculator one by one")
+        parser.add_argument('--mode', choices=['serial', 'processes', 'celery'],
+                            help="process_bulk_payroll mode (default: PAYROLL_SHARD_MODE)")
+        parser.add_argument('--no-memory', action='store_true',
+                            help="Do not trace peak memory (tracing slows the timed runs down)")
+        parser.add_argument('--label', default='', help="Free text stored with the results")
+
+    def handle(self, *args, **options):
+        results = []
+        for size in options['sizes']:
+            self.stdout.write(f"Preparing tenant of {size} employees...")
+            company, period = build_synthetic_tenant(size, seed=options['seed'])
+            for result in run_benchmarks(
+                company, period,
+                calculator_sample=options['calculator_sample'],
+                mode=options['mode'],
+                memory=not options['no_memory'],
+            ):
+                results.append(result)
+                self.stdout.write(
+                    f"  {result['target']:<38} {result['wall_seconds']:>10.3f}s "
+                    f"{result['queries']:>7} queries"
+                )
+
+        report = {
+            'label': options['label'],
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'settings': {
+                name: getattr(settings, name, None)
+                for name in ('PAYROLL_VECTORIZED', 'PAYROLL_WRITE_BATCH_SIZE', 'PAYROLL_SHARD_MODE',
+                             'PAYROLL_SHARD_SIZE', 'PAYROLL_WORKERS')
+            },
+            'seed': options['seed'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as out:
+            json.dump(report, out, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from payroll.models import PayrollPeriod
+from payroll.summaries import reconcile_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the materialized payslip totals of payroll periods from "
+        "their payslips and fixes the ones that are missing or out of date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', type=int, action='append', dest='periods',
+                            help="Period id to reconcile (repeatable; default: every period)")
+        parser.add_argument('--company', help="Only the periods of the company with this slug")
+
+    def handle(self, *args, **options):
+        periods = PayrollPeriod._base_manager.all()
+        if options['periods']:
+            periods = periods.filter(pk__in=options['periods'])
+        if options['company']:
+            periods = periods.filter(company__slug=options['company'])
+        period_ids = list(periods.values_list('id', flat=True))
+
+        fixed = reconcile_summaries(period_ids)
+        for period_id in fixed:
+            self.stdout.write(f"  fixed period {period_id}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {len(period_ids)} periods, fixed {len(fixed)}"
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0006_salaryrule_assigned_employees_salaryrule_is_global'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payslip',
+            name='is_dirty',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
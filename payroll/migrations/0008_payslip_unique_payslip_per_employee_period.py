@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:10
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_payslips(apps, schema_editor):
+    # Reruns of process_bulk_payroll used to create a second payslip per
+    # employee; keep the most recent one before adding the constraint.
+    Payslip = apps.get_model('payroll', 'Payslip')
+    duplicates = (
+        Payslip.objects.values('employee_id', 'period_id')
+        .annotate(keep=Max('id'), total=Count('id'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        Payslip.objects.filter(
+            employee_id=row['employee_id'], period_id=row['period_id']
+        ).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_user_role'),
+        ('hr', '0004_employeedocument'),
+        ('payroll', '0007_payslip_is_dirty'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_payslips, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='payslip',
+            constraint=models.UniqueConstraint(fields=('employee', 'period'), name='unique_payslip_per_employee_period'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:25
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def compute_deductions(brackets):
+    # Frozen copy of payroll.tax.compute_deductions as of this migration
+    deductions = []
+    cumulative_tax = Decimal('0.00')
+    previous_max = None
+    for bracket in sorted(brackets, key=lambda b: (b.min_income, b.pk or 0)):
+        rate = bracket.tax_rate / Decimal('100.0')
+        deduction = Decimal('0.00')
+        if previous_max is not None and bracket.min_income > 0:
+            deduction = previous_max * rate - cumulative_tax
+        deductions.append((bracket, round(deduction, 2)))
+
+        if bracket.max_income is None:
+            previous_max = None
+            continue
+        taxable = bracket.max_income - bracket.min_income
+        if taxable > 0:
+            cumulative_tax += taxable * rate
+        previous_max = bracket.max_income
+    return deductions
+
+
+def flag_manual_deductions(apps, schema_editor):
+    # Until now a non-zero deduction was never recalculated, so it may have
+    # been typed in. Keep every deduction that the formula would not give.
+    TaxBracket = apps.get_model('payroll', 'TaxBracket')
+    company_ids = TaxBracket.objects.values_list('company_id', flat=True).distinct()
+    for company_id in company_ids:
+        brackets = list(TaxBracket.objects.filter(company_id=company_id))
+        manual = [
+            bracket.pk
+            for bracket, deduction in compute_deductions(brackets)
+            if bracket.deduction_amount and bracket.deduction_amount != deduction
+        ]
+        TaxBracket.objects.filter(pk__in=manual).update(deduction_is_auto=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0010_payrolljob_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxbracket',
+            name='deduction_is_auto',
+            field=models.BooleanField(default=True, verbose_name='Calculate deduction automatically'),
+        ),
+        migrations.RunPython(flag_manual_deductions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0011_taxbracket_deduction_is_auto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payrollperiod',
+            name='config_snapshot',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='salaryrule',
+            name='effective_from',
+            field=models.DateField(blank=True, help_text='Leave blank if it has always applied', null=True),
+        ),
+        migrations.AddField(
+            model_name='salaryrule',
+            name='effective_to',
+            field=models.DateField(blank=True, help_text='Leave blank if it still applies', null=True),
+        ),
+        migrations.AddField(
+            model_name='taxbracket',
+            name='effective_from',
+            field=models.DateField(blank=True, help_text='Leave blank if it has always applied', null=True),
+        ),
+        migrations.AddField(
+            model_name='taxbracket',
+            name='effective_to',
+            field=models.DateField(blank=True, help_text='Leave blank if it still applies', null=True),
+        ),
+    ]
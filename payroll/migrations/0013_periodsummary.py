@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:31
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_summaries(apps, schema_editor):
+    PayrollPeriod = apps.get_model('payroll', 'PayrollPeriod')
+    PeriodSummary = apps.get_model('payroll', 'PeriodSummary')
+    Payslip = apps.get_model('payroll', 'Payslip')
+    fields = ('gross_pay', 'total_deductions', 'net_pay', 'overtime_pay', 'bonus')
+    totals = {
+        row['period_id']: row
+        for row in Payslip.objects.values('period_id')
+        .annotate(headcount=Count('id'), **{field: Sum(field) for field in fields})
+        .order_by()
+    }
+    PeriodSummary.objects.bulk_create([
+        PeriodSummary(
+            company_id=company_id,
+            period_id=period_id,
+            headcount=totals.get(period_id, {}).get('headcount', 0),
+            **{field: round(Decimal(totals.get(period_id, {}).get(field) or 0), 2) for field in fields},
+        )
+        for period_id, company_id in PayrollPeriod.objects.values_list('id', 'company_id')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_user_role'),
+        ('payroll', '0012_effective_dated_config'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('headcount', models.IntegerField(default=0)),
+                ('gross_pay', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_deductions', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('net_pay', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('overtime_pay', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('bonus', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_related', to='core.company')),
+                ('period', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='payroll.payrollperiod')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
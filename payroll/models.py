@@ -1,6 +1,10 @@
 
-from django.db import models
-from core.models import TenantAwareModel
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, router, transaction
+from django.utils import timezone
+from core.models import TenantAwareModel, TenantAwareManager
 from hr.models import Employee
 
 from core.utils import get_current_company
@@ -9,11 +13,43 @@ class PayrollPeriod(TenantAwareModel):
     start_date = models.DateField()
     end_date = models.DateField()
     is_processed = models.BooleanField(default=False)
+    # Rules and brackets in effect for the period, frozen on first use and
+    # kept once the period is processed. See payroll.config.
+    config_snapshot = models.JSONField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.start_date} - {self.end_date}"
 
-class SalaryRule(TenantAwareModel):
+class EffectiveDatedQuerySet(models.QuerySet):
+    def effective_on(self, day):
+        """Rows in effect on `day`; empty bounds mean "always"."""
+        return self.filter(
+            models.Q(effective_from__isnull=True) | models.Q(effective_from__lte=day),
+            models.Q(effective_to__isnull=True) | models.Q(effective_to__gte=day),
+        )
+
+EffectiveDatedManager = TenantAwareManager.from_queryset(EffectiveDatedQuerySet)
+
+class EffectiveDatedModel(TenantAwareModel):
+    """
+    Configuration with a validity window. A new version of a rule or bracket
+    is a new row: end the old one (effective_to) and start the new one the
+    day after, so past periods keep being computed with the old values.
+    """
+    effective_from = models.DateField(null=True, blank=True, help_text="Leave blank if it has always applied")
+    effective_to = models.DateField(null=True, blank=True, help_text="Leave blank if it still applies")
+
+    objects = EffectiveDatedManager()
+
+    class Meta:
+        abstract = True
+
+    def clean(self):
+        super().clean()
+        if self.effective_from and self.effective_to and self.effective_to < self.effective_from:
+            raise ValidationError({'effective_to': "Must be on or after the start date."})
+
+class SalaryRule(EffectiveDatedModel):
     RULE_TYPES = (
         ('ALLOWANCE', 'Allowance'),
         ('DEDUCTION', 'Deduction'),
@@ -33,7 +69,7 @@ class SalaryRule(TenantAwareModel):
     def __str__(self):
         return f"{self.name} ({self.get_rule_type_display()})"
 
-class TaxBracket(TenantAwareModel):
+class TaxBracket(EffectiveDatedModel):
     """
     Defines a progressive tax bracket.
     Example ISLR or similar:
@@ -45,52 +81,13 @@ class TaxBracket(TenantAwareModel):
     max_income = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Leave blank for infinity")
     tax_rate = models.DecimalField(max_digits=5, decimal_places=2, help_text="Percentage (e.g. 15.00 for 15%)")
     deduction_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, blank=True, help_text="Auto-calculated if left blank")
+    # Sustraendos are recomputed for the whole table after any bracket
+    # change (see payroll.tax.rebuild_deductions); unset to keep a manual one.
+    deduction_is_auto = models.BooleanField(default=True, verbose_name="Calculate deduction automatically")
 
     def save(self, *args, **kwargs):
         if not self.company_id:
              self.company = get_current_company()
-
-        # Auto-calculate Sustraendo if not provided
-        # Formula: (Previous_Max * Current_Rate) - Previous_Total_Tax
-        if self.deduction_amount == 0 and self.min_income > 0:
-            from decimal import Decimal
-            # Find previous brackets
-            previous_brackets = TaxBracket.objects.filter(
-                company=self.company,
-                max_income__lt=self.min_income
-            ).order_by('min_income')
-            
-            if previous_brackets.exists():
-                previous_max = previous_brackets.last().max_income
-                if previous_max:
-                    # Calculate tax on previous_max amount using those brackets
-                    previous_tax = Decimal('0.00')
-                    remainder = previous_max
-                    
-                    for bracket in previous_brackets:
-                        # Portion of income in this bracket
-                        bracket_limit = bracket.max_income if bracket.max_income else remainder
-                        # But since we are iterating ordered, max_income should exist for all except last (which matches previous_max)
-                        
-                        # Actually simpler: standard tax calc logic
-                        # But we can't easily import PayrollCalculator here due to circular imports.
-                        # Let's do raw math.
-                        start = bracket.min_income
-                        end = bracket.max_income
-                        
-                        # Ensure we don't go past the target (previous_max)
-                        if end > previous_max:
-                            end = previous_max
-                            
-                        taxable_in_bracket = end - start
-                        if taxable_in_bracket > 0:
-                            previous_tax += taxable_in_bracket * (bracket.tax_rate / Decimal('100.0'))
-                            
-                    # Now calculate theoretical tax at current rate for that same amount
-                    theoretical_tax = previous_max * (self.tax_rate / Decimal('100.0'))
-                    
-                    self.deduction_amount = theoretical_tax - previous_tax
-
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -105,14 +102,163 @@ class Payslip(TenantAwareModel):
     period = models.ForeignKey(PayrollPeriod, on_delete=models.CASCADE, related_name='payslips')
     gross_pay = models.DecimalField(max_digits=10, decimal_places=2)
     bonus = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # Tax on the bonus, already part of total_deductions. See payroll.services.bonus_tax().
+    bonus_tax = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     overtime_hours = models.DecimalField(max_digits=5, decimal_places=2, default=0.00)
     overtime_pay = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     total_deductions = models.DecimalField(max_digits=10, decimal_places=2)
     net_pay = models.DecimalField(max_digits=10, decimal_places=2)
     generated_at = models.DateTimeField(auto_now_add=True)
+    # Set when attendance, leave, salary, rules or brackets change after the
+    # payslip was generated. See PayrollBatch.recompute_dirty().
+    is_dirty = models.BooleanField(default=False, db_index=True)
+
+    class Meta:
+        constraints = [
+            # One payslip per employee and period, also the conflict target of
+            # the bulk upsert in PayrollBatch.save_payslips()
+            models.UniqueConstraint(fields=['employee', 'period'], name='unique_payslip_per_employee_period'),
+        ]
     
     # We can store a JSON field for the breakdown of rules applied if needed
     # rules_breakdown = models.JSONField(default=dict)
 
     def __str__(self):
         return f"Payslip for {self.employee} - {self.period}"
+
+    # The post_save/post_delete receivers apply the payslip's delta to its
+    # PeriodSummary (payroll.summaries); one transaction keeps both writes
+    # together under autocommit.
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            return super().delete(*args, **kwargs)
+
+class PayrollJob(TenantAwareModel):
+    """
+    One payroll run of a period, with live progress so long runs can happen
+    outside the request while the run page polls for processed/total/ETA.
+    """
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('SUCCESS', 'Success'),
+        ('FAILED', 'Failed'),
+    )
+    period = models.ForeignKey(PayrollPeriod, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # {stage: {'calls', 'seconds', 'queries'}}, see payroll.instrumentation
+    timings = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Payroll job {self.pk} for {self.period} ({self.get_status_display()})"
+
+    @property
+    def is_active(self):
+        return self.status in ('PENDING', 'RUNNING')
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100 if self.status == 'SUCCESS' else 0
+        return min(100, int(self.processed * 100 / self.total))
+
+    @property
+    def elapsed(self):
+        if not self.started_at:
+            return None
+        return (self.finished_at or timezone.now()) - self.started_at
+
+    @property
+    def throughput(self):
+        """Employees per second since the job started."""
+        elapsed = self.elapsed
+        if not elapsed or not elapsed.total_seconds():
+            return 0
+        return self.processed / elapsed.total_seconds()
+
+    @property
+    def eta(self):
+        """Estimated time left as a timedelta, None until there is a rate."""
+        throughput = self.throughput
+        if not self.is_active or not throughput:
+            return None
+        return timedelta(seconds=round(max(0, self.total - self.processed) / throughput))
+
+    # Progress is written with .update() so concurrent shards and the page
+    # polling it never overwrite each other's fields.
+    def _update(self, **fields):
+        fields['updated_at'] = timezone.now()
+        type(self)._base_manager.filter(pk=self.pk).update(**fields)
+        for name, value in fields.items():
+            if not hasattr(value, 'resolve_expression'):
+                setattr(self, name, value)
+
+    def mark_running(self):
+        self._update(status='RUNNING', started_at=timezone.now(), processed=0, error='')
+
+    def report_progress(self, processed, total=None):
+        if total is None:
+            self._update(processed=processed)
+        else:
+            self._update(processed=processed, total=total)
+
+    def add_progress(self, count):
+        self._update(processed=models.F('processed') + count)
+
+    def mark_finished(self, timings=None):
+        if timings is None:
+            self._update(status='SUCCESS', finished_at=timezone.now())
+        else:
+            self._update(status='SUCCESS', finished_at=timezone.now(), timings=timings)
+
+    @classmethod
+    def fail_stale(cls, period):
+        """
+        Marks FAILED the period's pending or running jobs without progress for
+        PAYROLL_JOB_STALE_AFTER seconds (progress bumps updated_at), so a
+        killed worker or a run that never reached the queue does not block
+        the period forever. Returns how many were failed.
+        """
+        stale_after = timedelta(seconds=getattr(settings, 'PAYROLL_JOB_STALE_AFTER', 15 * 60))
+        now = timezone.now()
+        return cls._base_manager.filter(
+            period=period, status__in=['PENDING', 'RUNNING'], updated_at__lt=now - stale_after,
+        ).update(
+            status='FAILED', finished_at=now, updated_at=now,
+            error=f"No progress for {stale_after}; the worker stopped or the job was never queued.",
+        )
+
+    def mark_failed(self, error, timings=None):
+        if timings is None:
+            self._update(status='FAILED', finished_at=timezone.now(), error=error)
+        else:
+            self._update(status='FAILED', finished_at=timezone.now(), error=error, timings=timings)
+
+class PeriodSummary(TenantAwareModel):
+    """
+    Running totals of a period's payslips, kept up to date by deltas on every
+    payslip write (see payroll.summaries) so reading them is a single row.
+    `manage.py reconcile_period_summaries` recomputes them from the payslips.
+    """
+    period = models.OneToOneField(PayrollPeriod, on_delete=models.CASCADE, related_name='summary')
+    headcount = models.IntegerField(default=0)
+    gross_pay = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_deductions = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net_pay = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    overtime_pay = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    bonus = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of {self.period}"
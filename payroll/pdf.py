@@ -0,0 +1,187 @@
+"""
+Payslip documents, one at a time or a whole period as a streamed ZIP.
+
+render_payslip() turns a payslip into a PDF with WeasyPrint, or returns the
+HTML when WeasyPrint is not installed (it is an optional dependency).
+
+stream_period_zip() yields a ZIP of every payslip of a period. The HTML is
+rendered here, a chunk of payslips at a time, and converted to PDF in a pool
+of worker processes. Only a few chunks are in flight at once and every file
+is written out as soon as it is ready, so memory stays flat whatever the
+headcount.
+
+cached_document() keeps rendered documents in the cache (alias
+PAYROLL_DOCUMENT_CACHE), keyed by document_key(): a hash of every row the
+template reads and of the template source itself. An edited payslip or
+template gets a new key, so nothing is ever invalidated, and the same key
+is the ETag the views use to answer conditional GETs with a 304.
+"""
+import hashlib
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template, render_to_string
+from .exports import ZipStream
+
+try:
+    import weasyprint
+except ImportError:
+    weasyprint = None
+
+PDF_CONTENT_TYPE = 'application/pdf'
+HTML_CONTENT_TYPE = 'text/html; charset=utf-8'
+
+# Cached documents: kind -> template
+DOCUMENT_TEMPLATES = {
+    'pdf': 'payroll/payslip_pdf.html',
+    'modal': 'payroll/payslip_modal.html',
+}
+
+_template_versions = {}
+_lock = threading.Lock()
+
+
+def pdf_available():
+    return weasyprint is not None
+
+
+def payslip_html(payslip):
+    return render_to_string('payroll/payslip_pdf.html', {'payslip': payslip})
+
+
+def html_to_pdf(html, base_url=None):
+    return weasyprint.HTML(string=html, base_url=base_url).write_pdf()
+
+
+def render_payslip(payslip, base_url=None):
+    """(content, content_type) of a payslip: a PDF, or its HTML without WeasyPrint."""
+    html = payslip_html(payslip)
+    if not pdf_available():
+        return html.encode(), HTML_CONTENT_TYPE
+    return html_to_pdf(html, base_url), PDF_CONTENT_TYPE
+
+
+def _template_version(name):
+    # Source hash, once per process: templates only change on deploy
+    version = _template_versions.get(name)
+    if version is None:
+        source = get_template(name).template.source
+        version = hashlib.sha256(source.encode()).hexdigest()[:16]
+        with _lock:
+            _template_versions[name] = version
+    return version
+
+
+def _row(instance, exclude=()):
+    if instance is None:
+        return []
+    return [
+        field.value_to_string(instance)
+        for field in instance._meta.concrete_fields
+        if field.name not in exclude
+    ]
+
+
+def document_key(payslip, kind):
+    """
+    Content hash of a payslip document: payslip, employee, position,
+    company and period rows, template source, and whether it is a real PDF.
+    Expects those relations to be loaded with select_related.
+    """
+    employee = payslip.employee
+    parts = [
+        kind, _template_version(DOCUMENT_TEMPLATES[kind]), str(pdf_available()),
+        _row(payslip), _row(employee), _row(employee.position), _row(employee.company),
+        _row(payslip.period, exclude=('config_snapshot',)),
+    ]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def cached_document(payslip, kind, base_url=None, key=None):
+    """(content, content_type) of a payslip document, rendered only on a cache miss."""
+    key = key or document_key(payslip, kind)
+    cache = caches[getattr(settings, 'PAYROLL_DOCUMENT_CACHE', 'default')]
+    cache_key = f'payroll:document:{key}'
+    document = cache.get(cache_key)
+    if document is None:
+        if kind == 'pdf':
+            document = render_payslip(payslip, base_url)
+        else:
+            document = (render_to_string(DOCUMENT_TEMPLATES[kind], {'payslip': payslip}).encode(), HTML_CONTENT_TYPE)
+        cache.set(cache_key, document, getattr(settings, 'PAYROLL_DOCUMENT_CACHE_TIMEOUT', 7 * 24 * 3600))
+    return document
+
+
+def payslip_filename(payslip, extension):
+    employee = payslip.employee
+    name = f'{employee.last_name}_{employee.first_name}'.replace(' ', '_').replace('/', '_')
+    return f'payslip_{payslip.id}_{name}.{extension}'
+
+
+def _convert_chunk(documents, base_url):
+    # Runs in the worker processes: no database, only HTML in and PDF out
+    return [(name, html_to_pdf(html, base_url)) for name, html in documents]
+
+
+def _html_chunks(payslips, chunk_size, extension):
+    chunk = []
+    for payslip in payslips:
+        chunk.append((payslip_filename(payslip, extension), payslip_html(payslip)))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _rendered_files(payslips, base_url, workers, chunk_size):
+    """Yields (filename, content) in payslip order."""
+    if not pdf_available():
+        for chunk in _html_chunks(payslips, chunk_size, 'html'):
+            for name, html in chunk:
+                yield name, html.encode()
+        return
+
+    chunks = _html_chunks(payslips, chunk_size, 'pdf')
+    if workers == 1:
+        for chunk in chunks:
+            yield from _convert_chunk(chunk, base_url)
+        return
+
+    # Spawned, not forked: the web server may be threaded and hold open
+    # connections, and the workers need neither
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_convert_chunk, chunk, base_url))
+            # Keep every worker busy, but never more than two chunks each
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def stream_period_zip(payslips, base_url=None, workers=None, chunk_size=None):
+    """
+    Yields the bytes of a ZIP with one document per payslip of `payslips`
+    (a queryset, iterated in chunks). PDFs are made by `workers` processes
+    (PAYROLL_PDF_WORKERS, then PAYROLL_WORKERS, then the number of CPUs),
+    `chunk_size` payslips per task.
+    """
+    workers = workers or getattr(settings, 'PAYROLL_PDF_WORKERS', None) \
+        or getattr(settings, 'PAYROLL_WORKERS', None) or os.cpu_count() or 1
+    chunk_size = chunk_size or getattr(settings, 'PAYROLL_PDF_CHUNK_SIZE', 25)
+    payslips = payslips.select_related('employee__company', 'employee__position', 'period')
+
+    stream = ZipStream()
+    # PDFs are already compressed
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, content in _rendered_files(payslips.iterator(chunk_size=500), base_url, workers, chunk_size):
+            archive.writestr(name, content)
+            yield stream.drain()
+    yield stream.drain()
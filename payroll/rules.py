@@ -0,0 +1,35 @@
+"""
+Salary rules compiled for a payroll run.
+
+A RulePlan holds a company's global rules plus an inverted index from
+employee id to the non-global rules assigned to that employee, built from
+the assignments frozen with the period (see payroll.config). Looking up the
+rules of an employee is then a dict access, with no queries.
+"""
+
+
+class RulePlan:
+    def __init__(self, rules, assignments):
+        """
+        rules: SalaryRule instances. assignments: (salaryrule_id, employee_id)
+        pairs of the assigned_employees M2M table; only used for non-global rules.
+        """
+        self.rules = list(rules)
+        self.global_rules = [rule for rule in self.rules if rule.is_global]
+
+        assignable = {rule.id: rule for rule in self.rules if not rule.is_global}
+        self.by_employee = {}
+        self.employees_by_rule = {rule_id: set() for rule_id in assignable}
+        for rule_id, employee_id in assignments:
+            rule = assignable.get(rule_id)
+            if rule is None:
+                continue
+            self.by_employee.setdefault(employee_id, []).append(rule)
+            self.employees_by_rule[rule_id].add(employee_id)
+
+    def rules_for(self, employee_id):
+        """Global rules plus the ones assigned to this employee."""
+        assigned = self.by_employee.get(employee_id)
+        if not assigned:
+            return self.global_rules
+        return self.global_rules + assigned
@@ -1,97 +1,494 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from decimal import Decimal
-from django.db import models
-from django.db.models import Q
-from hr.models import Attendance
-from .models import SalaryRule, Payslip, TaxBracket
+from multiprocessing import get_context
+from django.conf import settings
+from django.db import connection, connections, transaction
+from hr.models import Attendance, Employee, seconds_to_hours
+from .config import load_period_config
+from .dashboard import invalidate_dashboard
+from .instrumentation import NULL_TIMER, StageTimer
+from .models import Payslip, PayrollPeriod
+from .summaries import SUMMARY_FIELDS, apply_delta, payslip_values
+from .workers import compute_shard, init_worker
 
-class PayrollCalculator:
-    def __init__(self, employee, period):
-        self.employee = employee
-        self.period = period
+# Payslip columns written by the engine; bonus is edited on the run screen
+PAYSLIP_COMPUTED_FIELDS = [
+    'gross_pay', 'total_deductions', 'net_pay', 'overtime_hours', 'overtime_pay', 'bonus_tax', 'is_dirty',
+]
+# Payslip columns written when only the bonus changes
+PAYSLIP_BONUS_FIELDS = ['bonus', 'bonus_tax', 'total_deductions', 'net_pay']
 
-    def calculate_net_pay(self):
-        # 1. Calculate Hours Worked
-        attendance_records = Attendance.objects.filter(
-            employee=self.employee,
-            date__range=[self.period.start_date, self.period.end_date]
-        )
-        
-        total_hours = 0
-        total_overtime_hours = Decimal('0.0')
-        for record in attendance_records:
-            total_hours += record.get_hours_worked()
-            total_overtime_hours += Decimal(record.get_overtime_hours())
-            
-        # 2. Calculate Base Pay & Overtime
-        # Standard hours is usually 8 * 20 work days = 160 approx.
-        # But for accurate calculating, we should trust total_hours if hourly.
-        # Here we assume a fixed monthly salary.
+
+def calculate_pay(salary, worked_seconds, overtime_seconds, rules, tax_table, timer=NULL_TIMER):
+    """
+    Pure payroll maths for a single employee. All the data it needs is passed
+    in, so it can be used both per employee and for a whole period at once.
+    Worked and overtime time are whole seconds (see
+    AttendanceQuerySet.hours_by_employee), which keeps every step in exact
+    Decimal maths. `timer` (see payroll.instrumentation) times the hours,
+    rules and tax steps.
+    """
+    with timer.stage('hours'):
+        total_hours = seconds_to_hours(worked_seconds)
+        total_overtime_hours = seconds_to_hours(overtime_seconds)
+
+        # Base Salary is fixed. Overtime is added on top.
+        base_pay = salary
+
+        # Overtime Pay = Overtime Hours * Hourly Rate * 1.5
         # Hourly Rate = (Monthly Salary / 30 days) / 8 hours
-        hourly_rate = (self.employee.salary / Decimal('30')) / Decimal('8')
-        
-        # Base Pay is the Salary (assuming full attendance, but for MVP we pay full salary unless unpaid leave)
-        # To keep it simple: Base Salary is fixed. Overtime is added on top.
-        base_pay = self.employee.salary 
-        
-        overtime_pay = total_overtime_hours * (hourly_rate * Decimal('1.5'))
-        
+        # Folded into a single division: (seconds * salary * 1.5) / (3600 * 30 * 8)
+        overtime_pay = (Decimal(overtime_seconds) * salary * Decimal('1.5')) / Decimal('864000')
         gross_pay = base_pay + overtime_pay
-        
-        # 3. Apply Allowances
-        rules = SalaryRule.objects.all()
-        total_allowances = Decimal('0.00')
-        other_deductions = Decimal('0.00') 
-        
+
+    # Allowances & Deductions
+    total_allowances = Decimal('0.00')
+    other_deductions = Decimal('0.00')
+
+    with timer.stage('rules'):
         for rule in rules:
             amount = Decimal('0.00')
             if rule.amount:
                 amount = rule.amount
             elif rule.percentage:
                 amount = gross_pay * (rule.percentage / Decimal('100.0'))
-            
+
             if rule.rule_type == 'ALLOWANCE':
                 total_allowances += amount
             elif rule.rule_type == 'DEDUCTION':
                 other_deductions += amount
-        
-        total_gross = gross_pay + total_allowances
-        
-        # 4. Calculate Tax (ISLR / Progressive)
-        # Formula: (Income * Rate) - Deduction
-        tax_deduction = Decimal('0.00')
-        active_bracket = TaxBracket.objects.filter(
-            min_income__lte=total_gross
-        ).filter(
-            models.Q(max_income__gte=total_gross) | models.Q(max_income__isnull=True)
-        ).first()
-        
-        if active_bracket:
-            tax_rate = active_bracket.tax_rate / Decimal('100.0')
-            tax_deduction = (total_gross * tax_rate) - active_bracket.deduction_amount
-            if tax_deduction < 0:
-                tax_deduction = Decimal('0.00')
-
-        total_deductions = other_deductions + tax_deduction
-        net_pay = total_gross - total_deductions
-        
-        return {
-            'gross_pay': round(total_gross, 2), # Reporting Total Gross (Base + Allowances)
-            'total_deductions': round(total_deductions, 2),
-            'net_pay': round(net_pay, 2),
-            'hours_worked': round(total_hours, 2),
-            'overtime_hours': round(total_overtime_hours, 2),
-            'overtime_pay': round(overtime_pay, 2)
-        }
-    
+
+    total_gross = gross_pay + total_allowances
+
+    # Tax (ISLR / Progressive)
+    # Formula: (Income * Rate) - Deduction
+    # Bracket lookup is a binary search on the compiled TaxTable
+    with timer.stage('tax'):
+        tax_deduction = tax_table.tax_for(total_gross)
+
+    total_deductions = other_deductions + tax_deduction
+    net_pay = total_gross - total_deductions
+
+    return {
+        'gross_pay': round(total_gross, 2), # Reporting Total Gross (Base + Allowances)
+        'total_deductions': round(total_deductions, 2),
+        'net_pay': round(net_pay, 2),
+        'hours_worked': round(total_hours, 2),
+        'overtime_hours': round(total_overtime_hours, 2),
+        'overtime_pay': round(overtime_pay, 2)
+    }
+
+
+def bonus_tax(gross_pay, bonus, tax_table):
+    """
+    Extra tax due on a bonus paid on top of `gross_pay`: the tax on
+    gross + bonus minus the tax on gross alone, so the bonus is taxed at the
+    marginal rate. Taken from the stored (rounded) gross, so the engine and
+    the bonus editor always agree.
+    """
+    if not bonus:
+        return Decimal('0.00')
+    return round(tax_table.tax_for(gross_pay + bonus) - tax_table.tax_for(gross_pay), 2)
+
+
+class PayrollCalculator:
+    def __init__(self, employee, period, timer=None):
+        self.employee = employee
+        self.period = period
+        # Optional payroll.instrumentation.StageTimer
+        self.timer = timer or NULL_TIMER
+
+    def calculate_net_pay(self):
+        # 1. Calculate Hours Worked (aggregated in the database)
+        with self.timer.stage('attendance'):
+            worked_seconds, overtime_seconds = Attendance.objects.filter(
+                employee=self.employee,
+                date__range=[self.period.start_date, self.period.end_date]
+            ).hours_by_employee().get(self.employee.id, (0, 0))
+
+        # 2. Rules that apply to this employee (global or assigned) & the
+        # tax table, as configured for the period (frozen, cached snapshot)
+        with self.timer.stage('rules'):
+            config = load_period_config(self.period)
+            rules = config.rule_plan.rules_for(self.employee.id)
+        with self.timer.stage('tax'):
+            tax_table = config.tax_table
+
+        return calculate_pay(self.employee.salary, worked_seconds, overtime_seconds, rules, tax_table, self.timer)
+
     def generate_payslip(self):
+        """
+        Computes and saves the employee's payslip for the period. Saved
+        through the same upsert as a batch run, so calling it again
+        recomputes the payslip (keeping its bonus) instead of failing on
+        the (employee, period) constraint.
+        """
         data = self.calculate_net_pay()
-        payslip = Payslip.objects.create(
-            employee=self.employee,
-            period=self.period,
-            gross_pay=data['gross_pay'],
-            total_deductions=data['total_deductions'],
-            net_pay=data['net_pay'],
-            overtime_hours=data['overtime_hours'],
-            overtime_pay=data['overtime_pay']
+        batch = PayrollBatch(self.period, self.employee.company, timer=self.timer)
+        batch.save_payslips([(self.employee.id, data)])
+        return Payslip._base_manager.get(employee=self.employee, period=self.period)
+
+
+class PayrollBatch:
+    """
+    Set-based payroll engine for a whole PayrollPeriod.
+
+    Attendance is loaded once per period and company, salary rules and tax
+    brackets come from the period's configuration snapshot, every payslip
+    is computed in memory and the results are upserted in batches. The
+    number of queries does not grow with headcount.
+
+    `progress`, if given, is called as progress(processed, total) after each
+    batch of employees, e.g. PayrollJob.report_progress. `timer` is an
+    optional payroll.instrumentation.StageTimer.
+    """
+    def __init__(self, period, company=None, vectorized=None, batch_size=None, progress=None, timer=None):
+        self.period = period
+        self.company = company or period.company
+        # Rows per INSERT ... ON CONFLICT statement when saving payslips
+        self.batch_size = batch_size or getattr(settings, 'PAYROLL_WRITE_BATCH_SIZE', 1000)
+        # Optional NumPy kernel (see payroll.kernels), worth it on very large tenants
+        if vectorized is None:
+            vectorized = getattr(settings, 'PAYROLL_VECTORIZED', False)
+        self.vectorized = vectorized
+        self.progress = progress
+        self.timer = timer or NULL_TIMER
+
+    def report_progress(self, processed, total):
+        if self.progress:
+            self.progress(processed, total)
+
+    def load_employees(self):
+        with self.timer.stage('employees'):
+            return list(
+                Employee.objects.filter(company=self.company, is_active=True)
+                .values_list('id', 'salary')
+            )
+
+    # Rules and brackets come from the period's configuration snapshot, see
+    # payroll.config; the first of these builds it if needed.
+    def load_rule_plan(self):
+        with self.timer.stage('rules'):
+            return load_period_config(self.period).rule_plan
+
+    def load_tax_table(self):
+        with self.timer.stage('tax'):
+            return load_period_config(self.period).tax_table
+
+    def load_attendance(self, **filters):
+        """
+        Returns {employee_id: (worked_seconds, overtime_seconds)} for the period,
+        aggregated by the database in a single grouped query.
+        """
+        with self.timer.stage('attendance'):
+            return Attendance.objects.filter(
+                company=self.company,
+                date__range=[self.period.start_date, self.period.end_date],
+                **filters
+            ).hours_by_employee()
+
+    def calculate(self, employees=None, attendance=None, rule_plan=None, tax_table=None):
+        """
+        Returns a list of (employee_id, data) tuples, `data` being the same
+        dict PayrollCalculator.calculate_net_pay() returns.
+        """
+        if employees is None:
+            employees = self.load_employees()
+        if rule_plan is None:
+            rule_plan = self.load_rule_plan()
+        if tax_table is None:
+            tax_table = self.load_tax_table()
+        if attendance is None:
+            attendance = self.load_attendance()
+
+        if self.vectorized:
+            from .kernels import calculate_payslips
+            with self.timer.stage('kernel'):
+                return calculate_payslips(employees, attendance, rule_plan, tax_table)
+
+        timer = self.timer
+        results = []
+        for employee_id, salary in employees:
+            worked_seconds, overtime_seconds = attendance.get(employee_id, (0, 0))
+            rules = rule_plan.rules_for(employee_id)
+            data = calculate_pay(salary, worked_seconds, overtime_seconds, rules, tax_table, timer)
+            results.append((employee_id, data))
+        return results
+
+    def run(self, skip_existing=False):
+        """
+        Computes payslips for every active employee of the company and upserts
+        them, so running a period again refreshes it instead of duplicating
+        payslips. Bonuses already entered are kept. With `skip_existing`,
+        employees that already have a payslip for the period are left alone.
+        Employees are computed and written `batch_size` at a time, reporting
+        progress after each batch. Returns the saved Payslip objects.
+        """
+        employees = self.load_employees()
+        if skip_existing:
+            existing = set(
+                Payslip.objects.filter(period=self.period).values_list('employee_id', flat=True)
+            )
+            employees = [row for row in employees if row[0] not in existing]
+            bonuses = {}
+        else:
+            bonuses = self.existing_bonuses()
+
+        rule_plan = self.load_rule_plan()
+        tax_table = self.load_tax_table()
+        attendance = self.load_attendance()
+        self.report_progress(0, len(employees))
+
+        payslips = []
+        for start in range(0, len(employees), self.batch_size):
+            chunk = employees[start:start + self.batch_size]
+            results = self.calculate(chunk, attendance, rule_plan, tax_table)
+            payslips.extend(self.save_payslips(results, bonuses))
+            self.report_progress(len(payslips), len(employees))
+        return payslips
+
+    def existing_bonuses(self):
+        return dict(
+            Payslip.objects.filter(period=self.period).exclude(bonus=0)
+            .values_list('employee_id', 'bonus')
         )
-        return payslip
+
+    def shard_ranges(self, shard_size):
+        """
+        Splits the active employees into (first_id, last_id) ranges of at most
+        `shard_size` employees each, to be computed independently.
+        """
+        ids = list(
+            Employee.objects.filter(company=self.company, is_active=True)
+            .order_by('id').values_list('id', flat=True)
+        )
+        return [
+            (ids[start], ids[min(start + shard_size, len(ids)) - 1])
+            for start in range(0, len(ids), shard_size)
+        ]
+
+    def calculate_shard(self, first_id, last_id):
+        """calculate() restricted to the active employees with first_id <= id <= last_id."""
+        with self.timer.stage('employees'):
+            employees = list(
+                Employee.objects.filter(company=self.company, is_active=True, id__range=(first_id, last_id))
+                .values_list('id', 'salary')
+            )
+        attendance = self.load_attendance(employee__id__range=(first_id, last_id))
+        return self.calculate(employees, attendance)
+
+    def run_sharded(self, workers=None, shard_size=None):
+        """
+        run() spread over a process pool: every shard of employees is computed
+        in its own process, then the results are merged and upserted here.
+        Raises if any shard fails, in which case nothing is written. With a
+        single worker the shards are computed in-process.
+        """
+        workers = workers or getattr(settings, 'PAYROLL_WORKERS', None) or os.cpu_count() or 1
+        shard_size = shard_size or getattr(settings, 'PAYROLL_SHARD_SIZE', 5000)
+        ranges = self.shard_ranges(shard_size)
+        total = self.count_employees()
+        self.report_progress(0, total)
+
+        results = []
+        if workers == 1 or len(ranges) <= 1:
+            for first_id, last_id in ranges:
+                results.extend(self.calculate_shard(first_id, last_id))
+                self.report_progress(len(results), total)
+        else:
+            # Children must open their own database connections; spawned ones
+            # inherit no connection, lock or thread state from this process
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=get_context('spawn'),
+                                     initializer=init_worker) as pool:
+                timed = isinstance(self.timer, StageTimer)
+                futures = [
+                    pool.submit(compute_shard, self.period.id, self.company.id, first_id, last_id, self.vectorized, timed)
+                    for first_id, last_id in ranges
+                ]
+                for future in as_completed(futures):
+                    shard, timings = future.result()
+                    results.extend(shard)
+                    self.timer.merge(timings)
+                    self.report_progress(len(results), total)
+
+        return self.save_payslips(results, self.existing_bonuses())
+
+    def count_employees(self):
+        return Employee.objects.filter(company=self.company, is_active=True).count()
+
+    def save_payslips(self, results, bonuses=None):
+        """
+        Bulk upsert of computed payslips: one INSERT ... ON CONFLICT
+        (employee, period) DO UPDATE statement per `batch_size` rows.
+        The upsert never overwrites a payslip's bonus, but the bonus is still
+        taxed and part of the net pay: it is read from the locked row, so a
+        bonus edited while the run computes is priced as it is stored.
+        `bonuses` maps employee_id -> bonus of payslips not saved yet.
+        Each batch also moves the period's PeriodSummary by the difference
+        with the rows it replaces, in the same transaction.
+        """
+        bonuses = bonuses or {}
+        results = list(results)
+        tax_table = None
+        bonus_index = SUMMARY_FIELDS.index('bonus')
+        # MySQL/MariaDB upsert on any unique key and reject an explicit target
+        unique_fields = None
+        if connection.features.supports_update_conflicts_with_target:
+            unique_fields = ['employee', 'period']
+        saved = []
+        with self.timer.stage('persistence'):
+            for start in range(0, len(results), self.batch_size):
+                chunk = results[start:start + self.batch_size]
+                with transaction.atomic():
+                    previous = {
+                        row[0]: row[1:]
+                        for row in Payslip._base_manager.select_for_update()
+                        .filter(period=self.period, employee_id__in=[employee_id for employee_id, _ in chunk])
+                        .values_list('employee_id', *SUMMARY_FIELDS)
+                    }
+                    batch = []
+                    for employee_id, data in chunk:
+                        old = previous.get(employee_id)
+                        bonus = old[bonus_index] if old is not None else bonuses.get(employee_id, Decimal('0.00'))
+                        if bonus and tax_table is None:
+                            tax_table = self.load_tax_table()
+                        tax = bonus_tax(data['gross_pay'], bonus, tax_table)
+                        batch.append(Payslip(
+                            company=self.company,
+                            employee_id=employee_id,
+                            period=self.period,
+                            gross_pay=data['gross_pay'],
+                            bonus=bonus,
+                            bonus_tax=tax,
+                            total_deductions=data['total_deductions'] + tax,
+                            net_pay=data['net_pay'] + bonus - tax,
+                            overtime_hours=data['overtime_hours'],
+                            overtime_pay=data['overtime_pay'],
+                            is_dirty=False,
+                        ))
+                    saved.extend(Payslip.objects.bulk_create(
+                        batch,
+                        update_conflicts=True,
+                        unique_fields=unique_fields,
+                        update_fields=PAYSLIP_COMPUTED_FIELDS,
+                    ))
+                    # bulk_create sends no post_save: apply the totals here
+                    self._apply_summary_delta(batch, previous)
+        invalidate_dashboard(self.company.id)
+        return saved
+
+    def _apply_summary_delta(self, payslips, previous):
+        headcount = 0
+        amounts = [Decimal('0')] * len(SUMMARY_FIELDS)
+        for payslip in payslips:
+            old = previous.get(payslip.employee_id)
+            if old is None:
+                headcount += 1
+                old = [0] * len(SUMMARY_FIELDS)
+            for i, (new, before) in enumerate(zip(payslip_values(payslip), old)):
+                amounts[i] += new - Decimal(before or 0)
+        apply_delta(self.period.id, headcount, amounts)
+
+    def update_bonuses(self, bonuses):
+        """
+        Sets the bonus of many payslips of the period at once. `bonuses` maps
+        payslip_id -> Decimal bonus; ids of other periods are ignored. Bonus
+        tax, deductions and net pay are adjusted by the difference with the
+        old bonus in exact Decimal maths, without recomputing the payslip,
+        and the PeriodSummary moves by the same difference: one SELECT ...
+        FOR UPDATE and one UPDATE per `batch_size` payslips. Returns the
+        updated payslips.
+        """
+        tax_table = self.load_tax_table()
+        ids = sorted(bonuses)
+        updated = []
+        with self.timer.stage('persistence'):
+            for start in range(0, len(ids), self.batch_size):
+                with transaction.atomic():
+                    payslips = list(
+                        Payslip._base_manager.select_for_update()
+                        .filter(period=self.period, pk__in=ids[start:start + self.batch_size])
+                    )
+                    amounts = [Decimal('0')] * len(SUMMARY_FIELDS)
+                    for payslip in payslips:
+                        before = payslip_values(payslip)
+                        bonus = bonuses[payslip.pk]
+                        tax = bonus_tax(payslip.gross_pay, bonus, tax_table)
+                        payslip.total_deductions += tax - payslip.bonus_tax
+                        payslip.net_pay += (bonus - payslip.bonus) - (tax - payslip.bonus_tax)
+                        payslip.bonus, payslip.bonus_tax = bonus, tax
+                        for i, (new, old) in enumerate(zip(payslip_values(payslip), before)):
+                            amounts[i] += new - old
+                    # bulk_update sends no post_save: apply the totals here
+                    Payslip._base_manager.bulk_update(payslips, PAYSLIP_BONUS_FIELDS)
+                    apply_delta(self.period.id, 0, amounts)
+                updated.extend(payslips)
+        invalidate_dashboard(self.company.id)
+        return updated
+
+    def recompute_dirty(self):
+        """
+        Recalculates only the payslips of the period flagged by
+        mark_payslips_dirty() and returns how many were updated. Attendance is
+        aggregated for those employees only, so correcting a few timesheets
+        costs a handful of queries whatever the headcount. Finalized
+        periods are never recomputed: they stay as they were paid.
+        """
+        if self.period.is_processed:
+            raise ValueError(f"Period {self.period} is finalized; its payslips cannot be recomputed.")
+        with transaction.atomic():
+            # Lock the flagged rows so a change landing while we compute
+            # re-flags the payslip after we commit instead of being lost.
+            bonuses = dict(
+                Payslip.objects.select_for_update()
+                .filter(period=self.period, is_dirty=True)
+                .values_list('employee_id', 'bonus')
+            )
+            if not bonuses:
+                return 0
+
+            dirty_employees = Payslip.objects.filter(period=self.period, is_dirty=True).values('employee_id')
+            employees = list(
+                Employee.objects.filter(company=self.company, id__in=dirty_employees)
+                .values_list('id', 'salary')
+            )
+            attendance = self.load_attendance(employee_id__in=dirty_employees)
+            return len(self.save_payslips(self.calculate(employees, attendance), bonuses))
+
+    def finalize(self):
+        """
+        Marks the period processed, after recomputing the payslips still
+        flagged dirty so it is never paid with outdated amounts, and freezes
+        the configuration it was paid with. Returns the recomputed count.
+        """
+        with transaction.atomic():
+            # Locked so a concurrent finalize or recompute waits for this one
+            period = PayrollPeriod._base_manager.select_for_update().get(pk=self.period.pk)
+            if period.is_processed:
+                return 0
+            recomputed = self.recompute_dirty()
+            load_period_config(self.period)
+            period.is_processed = self.period.is_processed = True
+            period.save(update_fields=['is_processed'])
+        return recomputed
+
+
+def mark_payslips_dirty(company_id, employee_ids=None, start_date=None, end_date=None):
+    """
+    Flags the payslips of open periods affected by a change so the next
+    PayrollBatch.recompute_dirty() picks them up. Leave employee_ids out for
+    company-wide changes (rules, tax brackets) and the dates out when every
+    open period is affected. Returns the number of payslips flagged.
+    """
+    payslips = Payslip._base_manager.filter(
+        company_id=company_id, period__is_processed=False, is_dirty=False
+    )
+    if employee_ids is not None:
+        payslips = payslips.filter(employee_id__in=employee_ids)
+    if start_date is not None:
+        payslips = payslips.filter(period__end_date__gte=start_date)
+    if end_date is not None:
+        payslips = payslips.filter(period__start_date__lte=end_date)
+    return payslips.update(is_dirty=True)
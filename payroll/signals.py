@@ -0,0 +1,131 @@
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+from hr.models import Attendance, Department, Employee, LeaveRequest
+from hr.signals import attendance_imported
+from .models import PayrollPeriod, PeriodSummary, Payslip, SalaryRule, TaxBracket
+from .config import invalidate_open_snapshots
+from .dashboard import invalidate_dashboard
+from .summaries import SUMMARY_FIELDS, payslip_deleted, payslip_saved
+from .services import mark_payslips_dirty
+from .tax import rebuild_deductions
+
+
+@receiver([post_save, post_delete], sender=TaxBracket)
+def tax_bracket_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        # Loaded fixtures keep their deductions; open periods still re-snapshot
+        invalidate_open_snapshots(instance.company_id)
+        return
+    # Sustraendos depend on every lower bracket, so recompute the whole table
+    rebuild_deductions(instance.company_id)
+    invalidate_open_snapshots(instance.company_id)
+    mark_payslips_dirty(instance.company_id)
+
+
+# --- Dirty tracking for incremental recomputation ---
+# Each handler flags the payslips of open periods that depend on the row
+# that changed. PayrollBatch.recompute_dirty() then recalculates just those.
+
+@receiver(pre_save, sender=Attendance)
+@receiver(pre_save, sender=LeaveRequest)
+@receiver(pre_save, sender=Employee)
+@receiver(pre_save, sender=Payslip)
+def remember_previous_values(sender, instance, raw=False, **kwargs):
+    # An edit can move a punch/leave to another employee or date, change a
+    # salary or a payslip's amounts, so keep what the row looked like before
+    # the save.
+    instance._payroll_previous = None
+    if raw or not instance.pk:
+        return
+    fields = {
+        Attendance: ('employee_id', 'date', 'date'),
+        LeaveRequest: ('employee_id', 'start_date', 'end_date'),
+        Employee: ('salary',),
+        Payslip: ('period_id',) + SUMMARY_FIELDS,
+    }[sender]
+    instance._payroll_previous = sender._base_manager.filter(pk=instance.pk).values_list(*fields).first()
+
+
+@receiver([post_save, post_delete], sender=Attendance)
+def attendance_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    mark_payslips_dirty(instance.company_id, [instance.employee_id], instance.date, instance.date)
+    previous = getattr(instance, '_payroll_previous', None)
+    if previous and previous != (instance.employee_id, instance.date, instance.date):
+        mark_payslips_dirty(instance.company_id, [previous[0]], previous[1], previous[2])
+
+
+@receiver(attendance_imported)
+def attendance_bulk_imported(sender, company_id, employee_ids, start_date, end_date, **kwargs):
+    # A punch file can cover the whole staff: a few hundred ids per query
+    for i in range(0, len(employee_ids), 500):
+        mark_payslips_dirty(company_id, employee_ids[i:i + 500], start_date, end_date)
+
+
+@receiver([post_save, post_delete], sender=LeaveRequest)
+def leave_request_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    mark_payslips_dirty(instance.company_id, [instance.employee_id], instance.start_date, instance.end_date)
+    previous = getattr(instance, '_payroll_previous', None)
+    if previous and previous != (instance.employee_id, instance.start_date, instance.end_date):
+        mark_payslips_dirty(instance.company_id, [previous[0]], previous[1], previous[2])
+
+
+@receiver(post_save, sender=Employee)
+def employee_salary_changed(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, '_payroll_previous', None)
+    if raw or created or not previous or previous[0] == instance.salary:
+        return
+    mark_payslips_dirty(instance.company_id, [instance.pk])
+
+
+@receiver([post_save, post_delete], sender=SalaryRule)
+def salary_rule_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_open_snapshots(instance.company_id)
+        mark_payslips_dirty(instance.company_id)
+
+
+@receiver(m2m_changed, sender=SalaryRule.assigned_employees.through)
+def salary_rule_assignment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    invalidate_open_snapshots(instance.company_id)
+    if reverse:
+        # employee.salary_rules.add(...): only that employee is affected
+        mark_payslips_dirty(instance.company_id, [instance.pk])
+    elif action == 'post_clear' or not pk_set:
+        mark_payslips_dirty(instance.company_id)
+    else:
+        mark_payslips_dirty(instance.company_id, list(pk_set))
+
+
+# --- Cached dashboard figures (payroll.dashboard) ---
+
+@receiver([post_save, post_delete], sender=Payslip)
+@receiver([post_save, post_delete], sender=PayrollPeriod)
+@receiver([post_save, post_delete], sender=Employee)
+@receiver([post_save, post_delete], sender=Department)
+def dashboard_data_changed(sender, instance, **kwargs):
+    invalidate_dashboard(instance.company_id)
+
+
+# --- Period totals (payroll.summaries) ---
+
+@receiver(post_save, sender=PayrollPeriod)
+def period_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        PeriodSummary.objects.create(company_id=instance.company_id, period=instance)
+
+
+@receiver(post_save, sender=Payslip)
+def payslip_saved_totals(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        payslip_saved(instance, created, getattr(instance, '_payroll_previous', None))
+
+
+@receiver(post_delete, sender=Payslip)
+def payslip_deleted_totals(sender, instance, **kwargs):
+    payslip_deleted(instance)
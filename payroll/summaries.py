@@ -0,0 +1,112 @@
+"""
+Materialized per-period payslip totals (PeriodSummary).
+
+Every payslip write turns into a delta applied with a single UPDATE ... SET
+total = total + delta on the period's summary row: the payslip signals do it
+for save()/delete(), PayrollBatch.save_payslips() for its bulk upserts, each
+in the same transaction as the payslip write (Payslip.save()/delete() open
+one). Reading a period's totals is then one row whatever its headcount.
+reconcile_summaries() rebuilds the rows from the payslips, for periods whose
+summary went missing or drifted (e.g. after raw SQL or a queryset update()).
+"""
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from .models import PayrollPeriod, PeriodSummary, Payslip
+
+# Payslip columns summed into PeriodSummary columns of the same name
+SUMMARY_FIELDS = ('gross_pay', 'total_deductions', 'net_pay', 'overtime_pay', 'bonus')
+
+
+def payslip_values(payslip):
+    return [Decimal(getattr(payslip, field) or 0) for field in SUMMARY_FIELDS]
+
+
+def apply_delta(period_id, headcount=0, amounts=None):
+    """
+    Adds `headcount` and `amounts` (in SUMMARY_FIELDS order) to a period's
+    totals. A period without a summary row is reconciled instead, which
+    already counts the payslip being written.
+    """
+    amounts = amounts or [0] * len(SUMMARY_FIELDS)
+    changes = {field: F(field) + amount for field, amount in zip(SUMMARY_FIELDS, amounts) if amount}
+    if headcount:
+        changes['headcount'] = F('headcount') + headcount
+    if not changes:
+        return
+    if not PeriodSummary._base_manager.filter(period_id=period_id).update(**changes):
+        if PayrollPeriod._base_manager.filter(pk=period_id).exists():
+            reconcile_summaries([period_id])
+
+
+def payslip_saved(payslip, created, previous=None):
+    """`previous`: (period_id, *SUMMARY_FIELDS) of the row before the save."""
+    values = payslip_values(payslip)
+    if created or previous is None:
+        apply_delta(payslip.period_id, 1, values)
+    elif previous[0] != payslip.period_id:
+        apply_delta(previous[0], -1, [-Decimal(value or 0) for value in previous[1:]])
+        apply_delta(payslip.period_id, 1, values)
+    else:
+        apply_delta(payslip.period_id, 0, [new - Decimal(old or 0) for new, old in zip(values, previous[1:])])
+
+
+def payslip_deleted(payslip):
+    # Never create a summary on delete: the period may be going away too
+    changes = {field: F(field) - value for field, value in zip(SUMMARY_FIELDS, payslip_values(payslip))}
+    PeriodSummary._base_manager.filter(period_id=payslip.period_id).update(
+        headcount=F('headcount') - 1, **changes
+    )
+
+
+def reconcile_summaries(period_ids=None):
+    """
+    Recomputes the summaries of the given periods (all of them by default)
+    from their payslips with one grouped query and writes the ones that are
+    missing or wrong. Returns the ids of the periods that were fixed.
+    """
+    periods = PayrollPeriod._base_manager.all()
+    if period_ids is not None:
+        periods = periods.filter(pk__in=period_ids)
+    periods = dict(periods.values_list('id', 'company_id'))
+
+    totals = {
+        row['period_id']: row
+        for row in Payslip._base_manager.filter(period_id__in=list(periods))
+        .values('period_id')
+        .annotate(headcount=Count('id'), **{field: Sum(field) for field in SUMMARY_FIELDS})
+        .order_by()
+    }
+    summaries = {
+        summary.period_id: summary
+        for summary in PeriodSummary._base_manager.filter(period_id__in=list(periods))
+    }
+
+    fixed = []
+    for period_id, company_id in periods.items():
+        row = totals.get(period_id, {})
+        expected = {'headcount': row.get('headcount', 0)}
+        expected.update({field: round(Decimal(row.get(field) or 0), 2) for field in SUMMARY_FIELDS})
+
+        summary = summaries.get(period_id)
+        if summary is None:
+            try:
+                with transaction.atomic():
+                    PeriodSummary._base_manager.create(company_id=company_id, period_id=period_id, **expected)
+            except IntegrityError:
+                # Created concurrently, from the same payslips
+                continue
+            fixed.append(period_id)
+        elif any(getattr(summary, field) != value for field, value in expected.items()):
+            PeriodSummary._base_manager.filter(pk=summary.pk).update(**expected)
+            fixed.append(period_id)
+    return fixed
+
+
+def period_totals(period):
+    """The PeriodSummary of a period, built from its payslips if missing."""
+    summary = PeriodSummary._base_manager.filter(period=period).first()
+    if summary is None:
+        reconcile_summaries([period.pk])
+        summary = PeriodSummary._base_manager.get(period=period)
+    return summary
@@ -1,39 +1,138 @@
-
-from celery import shared_task
-from core.models importCompany
-from .models import PayrollPeriod, Employee
-from .services import PayrollCalculator
+from decimal import Decimal
+from celery import chord, shared_task
+from django.conf import settings
+from core.models import Company
+from .instrumentation import NULL_TIMER, StageTimer, new_timer
+from .models import PayrollJob, PayrollPeriod
+from .services import PayrollBatch
 
 @shared_task
-def process_bulk_payroll(period_id, company_id):
+def process_bulk_payroll(period_id, company_id, mode=None, job_id=None, finalize=True):
     """
     Processes payroll for all active employees in a company for a given period.
+
+    mode (defaults to settings.PAYROLL_SHARD_MODE):
+      'serial'    - one batch run inside this task
+      'processes' - shards computed on a local process pool, see PayrollBatch.run_sharded()
+      'celery'    - shards computed as parallel subtasks, merged by finish_sharded_payroll
+    The period is only marked processed once every shard has succeeded, and
+    only when `finalize` is set; otherwise payslips are left as a draft.
+
+    Progress is recorded on the PayrollJob `job_id`, or on a new one, along
+    with per-stage timings when settings.PAYROLL_STAGE_TIMINGS is on.
     """
+    mode = mode or getattr(settings, 'PAYROLL_SHARD_MODE', 'serial')
+    job = None
+    timer = new_timer()
     try:
         company = Company.objects.get(id=company_id)
         period = PayrollPeriod.objects.get(id=period_id)
+        if job_id:
+            job = PayrollJob._base_manager.get(id=job_id)
+        else:
+            job = PayrollJob.objects.create(company=company, period=period)
+        job.mark_running()
         
-        # Ensure we are in the correct tenant context if needed, 
-        # but since we are filtering by company explicitly in the query, 
-        # we might just need to pass the employee objects.
-        # However, our models are TenantAware, so we might need to mock the request/context 
-        # OR use a context manager to set the tenant for this thread.
+        # Our models are TenantAware, so set the tenant for this thread
+        # in case anything downstream relies on the default managers.
         from core.utils import set_current_company, remove_current_company
         set_current_company(company)
         
-        employees = Employee.objects.filter(company=company, is_active=True)
-        results = []
-        
-        for employee in employees:
-            calculator = PayrollCalculator(employee, period)
-            payslip = calculator.generate_payslip()
-            results.append(payslip.id)
-            
-        period.is_processed = True
-        period.save()
-        
-        remove_current_company()
-        return f"Successfully processed {len(results)} payslips for {company.name}"
+        try:
+            batch = PayrollBatch(period, company, progress=job.report_progress, timer=timer)
+            with timer.recording():
+                # Snapshot the period's rules and brackets once, before any
+                # shard reads them
+                batch.load_rule_plan()
+                if mode == 'celery':
+                    ranges = batch.shard_ranges(getattr(settings, 'PAYROLL_SHARD_SIZE', 5000))
+                    job.report_progress(0, batch.count_employees())
+                    timed = isinstance(timer, StageTimer)
+                    shards = [
+                        compute_payroll_shard.s(period_id, company_id, first_id, last_id, job.id, timed)
+                        for first_id, last_id in ranges
+                    ]
+                    finish = finish_sharded_payroll.s(period_id, company_id, job.id, finalize, timer.as_dict())
+                    if process_bulk_payroll.app.conf.task_always_eager:
+                        # Eager chords still need a result backend, so run the
+                        # shards in-process; .get() re-raises a failed shard.
+                        return finish.apply(args=([shard.apply().get() for shard in shards],)).get()
+                    if shards:
+                        # The callback only runs once every shard task succeeded
+                        chord(shards)(finish.on_error(fail_payroll_job.s(job.id)))
+                        return f"Dispatched {len(shards)} payroll shards for {company.name}"
+                    payslips = []
+                elif mode == 'processes':
+                    payslips = batch.run_sharded()
+                else:
+                    # Attendance, rules and brackets are loaded once for the whole
+                    # period and payslips are written in bulk.
+                    payslips = batch.run()
+                    
+                if finalize:
+                    batch.finalize()
+            job.mark_finished(timer.as_dict())
+        finally:
+            remove_current_company()
+
+        return f"Successfully processed {len(payslips)} payslips for {company.name}"
         
     except Exception as e:
+        if job is not None:
+            job.mark_failed(str(e), timer.as_dict())
         return f"Error processing payroll: {str(e)}"
+
+@shared_task
+def compute_payroll_shard(period_id, company_id, first_id, last_id, job_id=None, timed=False):
+    """
+    Computes (but does not save) the payslips of one shard of employees.
+    Errors are not swallowed here, so a failed shard stops the chord.
+    """
+    timer = StageTimer() if timed else NULL_TIMER
+    with timer.recording():
+        company = Company.objects.get(id=company_id)
+        period = PayrollPeriod.objects.get(id=period_id)
+        results = PayrollBatch(period, company, timer=timer).calculate_shard(first_id, last_id)
+    if job_id:
+        PayrollJob._base_manager.get(id=job_id).add_progress(len(results))
+    # JSON serializer: Decimals travel as strings
+    return {
+        'payslips': [
+            [employee_id, {key: str(value) for key, value in data.items()}]
+            for employee_id, data in results
+        ],
+        'timings': timer.as_dict(),
+    }
+
+@shared_task
+def finish_sharded_payroll(shard_results, period_id, company_id, job_id=None, finalize=True, timings=None):
+    """
+    Chord callback: merges every shard, upserts the payslips and closes the period.
+    `timings` are the dispatching task's, the shards' are added to them.
+    """
+    timer = new_timer()
+    timer.merge(timings or {})
+    with timer.recording():
+        company = Company.objects.get(id=company_id)
+        period = PayrollPeriod.objects.get(id=period_id)
+        batch = PayrollBatch(period, company, timer=timer)
+
+        results = []
+        for shard in shard_results:
+            timer.merge(shard['timings'])
+            results.extend(
+                (employee_id, {key: Decimal(value) for key, value in data.items()})
+                for employee_id, data in shard['payslips']
+            )
+        payslips = batch.save_payslips(results, batch.existing_bonuses())
+
+        if finalize:
+            batch.finalize()
+    if job_id:
+        PayrollJob._base_manager.get(id=job_id).mark_finished(timer.as_dict())
+    return f"Successfully processed {len(payslips)} payslips for {company.name}"
+
+@shared_task
+def fail_payroll_job(request, exc, traceback, job_id):
+    """Chord error callback: a shard failed, nothing was written."""
+    PayrollJob._base_manager.get(id=job_id).mark_failed(str(exc))
@@ -0,0 +1,118 @@
+"""
+Compiled tax bracket tables.
+
+A TaxTable holds a company's brackets as sorted edges with their rate and
+sustraendo and looks incomes up with a binary search, so the tax step of a
+payroll run is pure in-memory work. Runs compile it from the brackets frozen
+with their period (see payroll.config), which is also where it is cached.
+
+The TaxBracket save/delete signals (see payroll/signals.py) call
+rebuild_deductions(), which recomputes the sustraendo of every bracket of
+the company in one pass over the sorted table.
+"""
+from bisect import bisect_right
+from decimal import Decimal
+from .models import TaxBracket
+
+
+class TaxTable:
+    """
+    Tax brackets of one company, ordered by min_income.
+
+    find() returns the same bracket as the old query: the first bracket by
+    min_income whose range contains the income (max_income null = infinity).
+    """
+
+    def __init__(self, brackets):
+        self.brackets = sorted(brackets, key=lambda b: (b.min_income, b.pk or 0))
+        self.edges = [bracket.min_income for bracket in self.brackets]
+        # Bisect is only valid when ranges don't overlap, which is how a tax
+        # table is meant to be set up. Misconfigured tables still work, just
+        # with a linear scan.
+        self.disjoint = all(
+            current.max_income is not None and current.max_income < following.min_income
+            for current, following in zip(self.brackets, self.brackets[1:])
+        )
+
+    def __iter__(self):
+        return iter(self.brackets)
+
+    def __len__(self):
+        return len(self.brackets)
+
+    def find(self, income):
+        if not self.disjoint:
+            for bracket in self.brackets:
+                if bracket.min_income <= income and (bracket.max_income is None or bracket.max_income >= income):
+                    return bracket
+            return None
+
+        index = bisect_right(self.edges, income) - 1
+        if index < 0:
+            return None
+        bracket = self.brackets[index]
+        if bracket.max_income is None or bracket.max_income >= income:
+            return bracket
+        return None
+
+    def tax_for(self, income):
+        """(Income * Rate) - Deduction, never below zero."""
+        bracket = self.find(income)
+        if not bracket:
+            return Decimal('0.00')
+        tax = (income * (bracket.tax_rate / Decimal('100.0'))) - bracket.deduction_amount
+        if tax < 0:
+            return Decimal('0.00')
+        return tax
+
+
+def compute_deductions(brackets):
+    """
+    Sustraendo of each bracket, in one pass over brackets sorted by min_income:
+    (Previous_Max * Current_Rate) - Tax accumulated up to Previous_Max, so the
+    tax is continuous at every edge. The lowest bracket has no deduction.
+    Returns (bracket, deduction) pairs, deductions rounded to cents.
+    """
+    deductions = []
+    cumulative_tax = Decimal('0.00')
+    previous_max = None
+    for bracket in sorted(brackets, key=lambda b: (b.min_income, b.pk or 0)):
+        rate = bracket.tax_rate / Decimal('100.0')
+        deduction = Decimal('0.00')
+        if previous_max is not None and bracket.min_income > 0:
+            deduction = previous_max * rate - cumulative_tax
+        deductions.append((bracket, round(deduction, 2)))
+
+        if bracket.max_income is None:
+            # Open-ended: nothing above it can build on it
+            previous_max = None
+            continue
+        taxable = bracket.max_income - bracket.min_income
+        if taxable > 0:
+            cumulative_tax += taxable * rate
+        previous_max = bracket.max_income
+    return deductions
+
+
+def rebuild_deductions(company_id):
+    """
+    Recomputes the automatic sustraendos of a company's tax table with one
+    read and at most one bulk_update.
+    Each effective window (effective_from, effective_to) is its own table.
+    Brackets with deduction_is_auto unset keep their manual deduction.
+    Returns the number of brackets updated.
+    """
+    tables = {}
+    for bracket in TaxBracket._base_manager.filter(company_id=company_id):
+        tables.setdefault((bracket.effective_from, bracket.effective_to), []).append(bracket)
+
+    changed = []
+    for brackets in tables.values():
+        for bracket, deduction in compute_deductions(brackets):
+            if bracket.deduction_is_auto and bracket.deduction_amount != deduction:
+                bracket.deduction_amount = deduction
+                changed.append(bracket)
+    if changed:
+        # bulk_update sends no signals, so this does not trigger itself
+        TaxBracket._base_manager.bulk_update(changed, ['deduction_amount'])
+    return len(changed)
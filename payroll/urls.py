@@ -6,7 +6,17 @@ urlpatterns = [
     path('', views.payroll_dashboard, name='payroll_dashboard'),
     path('process/', views.process_payroll, name='process_payroll'),
     path('run/<int:period_id>/', views.run_payroll, name='run_payroll'),
+    path('run/<int:period_id>/rows/', views.run_payroll_rows, name='run_payroll_rows'),
     path('run/<int:period_id>/finalize/', views.finalize_payroll, name='finalize_payroll'),
+    path('run/<int:period_id>/recompute/', views.recompute_payroll, name='recompute_payroll'),
+    path('run/<int:period_id>/timings.csv', views.export_payroll_timings, name='export_payroll_timings'),
+    path('run/<int:period_id>/bonuses/', views.bulk_update_bonuses, name='bulk_update_bonuses'),
+    path('run/<int:period_id>/bonuses.csv', views.export_period_bonuses, name='export_period_bonuses'),
+    path('run/<int:period_id>/export.csv', views.export_period_payslips, {'file_format': 'csv'}, name='export_period_payslips_csv'),
+    path('run/<int:period_id>/export.xlsx', views.export_period_payslips, {'file_format': 'xlsx'}, name='export_period_payslips_xlsx'),
+    path('run/<int:period_id>/bank-files.zip', views.download_bank_files, name='download_bank_files'),
+    path('run/<int:period_id>/payslips.zip', views.download_period_payslips, name='download_period_payslips'),
+    path('jobs/<int:job_id>/progress/', views.payroll_job_progress, name='payroll_job_progress'),
     path('payslip/<int:payslip_id>/update-bonus/', views.update_payslip_bonus, name='update_payslip_bonus'),
     path('payslip/<int:payslip_id>/', views.load_payslip_modal, name='load_payslip_modal'),
     path('payslip/<int:payslip_id>/pdf/', views.generate_payslip_pdf, name='generate_payslip_pdf'),
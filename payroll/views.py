@@ -1,16 +1,28 @@
 
+import csv
+from django.contrib import messages
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, HttpResponseBadRequest
-from django.template.loader import render_to_string
-from django.views.decorators.http import require_POST
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_POST
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse_lazy
-from django.db.models import Sum
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
-from .models import Payslip, PayrollPeriod, SalaryRule, TaxBracket
-from .forms import SalaryRuleForm, TaxBracketForm
-from hr.models import Employee, Attendance, Department 
-from .services import PayrollCalculator
+from .models import Payslip, PayrollJob, PayrollPeriod, SalaryRule, TaxBracket
+from .forms import BonusForm, BonusUploadForm, SalaryRuleForm, TaxBracketForm, parse_bonuses
+from hr.models import Employee, Attendance
+from .dashboard import dashboard_summary
+from .summaries import period_totals
+from .instrumentation import write_timings_csv
+from .bank_files import BANK_FILE_FORMATS, stream_bank_files
+from .exports import stream_payslip_export
+from .pdf import PDF_CONTENT_TYPE, cached_document, document_key, stream_period_zip
+from .services import PayrollBatch
+from .tasks import process_bulk_payroll
+from core.pagination import keyset_page
 from core.utils import get_current_company
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -43,6 +55,8 @@ class TaxBracketListView(LoginRequiredMixin, ListView):
     model = TaxBracket
     template_name = 'payroll/tax_bracket_list.html'
     context_object_name = 'brackets'
+    # One table per effective window, oldest first
+    ordering = [F('effective_from').asc(nulls_first=True), 'effective_to', 'min_income']
 
 class TaxBracketCreateView(LoginRequiredMixin, CreateView):
     model = TaxBracket
@@ -88,27 +102,10 @@ def payroll_dashboard(request):
             check_out__isnull=True
         ).first()
 
-    # Get latest active period or create a dummy one for display
-    period = PayrollPeriod.objects.filter(is_processed=False).first()
-    
-    total_cost = 0
-    if period:
-        total_cost = Payslip.objects.filter(period=period).aggregate(Sum('net_pay'))['net_pay__sum'] or 0
-
-    active_employees = Employee.objects.filter(is_active=True).count()
-    department_count = Department.objects.count()
-
-    # Chart Data: Last 6 processed periods
-    last_periods = PayrollPeriod.objects.filter(is_processed=True).order_by('-end_date')[:6]
-    last_periods = list(last_periods)[::-1] # Reverse to chronological
-    
-    chart_dates = []
-    chart_values = []
-    
-    for p in last_periods:
-        cost = Payslip.objects.filter(period=p).aggregate(Sum('net_pay'))['net_pay__sum'] or 0
-        chart_dates.append(p.end_date.strftime("%b"))
-        chart_values.append(float(cost))
+    # Period totals, chart and headcounts: cached per tenant (payroll.dashboard)
+    summary = dashboard_summary(company)
+    chart_dates = summary['chart_dates']
+    chart_values = summary['chart_values']
         
     # If no data, show empty placeholders
     if not chart_dates:
@@ -116,10 +113,10 @@ def payroll_dashboard(request):
         chart_values = [0]
 
     return render(request, 'dashboard.html', {
-        'total_cost': total_cost,
-        'active_employees': active_employees,
-        'department_count': department_count,
-        'period': period,
+        'total_cost': summary['total_cost'],
+        'active_employees': summary['active_employees'],
+        'department_count': summary['department_count'],
+        'period': summary['period'],
         'active_attendance': active_attendance,
         'chart_dates': chart_dates,
         'chart_values': chart_values,
@@ -128,9 +125,9 @@ def payroll_dashboard(request):
 @require_POST
 def process_payroll(request):
     """
-    Simulates running payroll. In real app, this might kick off a Celery task.
-    For this demo, we'll just ensure a period exists and payslips are generated 
-    (or redirect to the table view).
+    Generates the payslips of the period and redirects to the table view.
+    Runs of PAYROLL_ASYNC_THRESHOLD employees or more go to Celery and the
+    run page follows them through their PayrollJob; smaller ones run here.
     """
     # Find or create next period
     # For demo simplicity, get the first period
@@ -140,86 +137,299 @@ def process_payroll(request):
         from datetime import date
         period = PayrollPeriod.objects.create(start_date=date(2023, 10, 1), end_date=date(2023, 10, 15))
 
-    # Generate payslips if they don't exist
-    employees = Employee.objects.filter(is_active=True)
-    for emp in employees:
-        if not Payslip.objects.filter(employee=emp, period=period).exists():
-            PayrollCalculator(emp, period).generate_payslip()
-            
+    PayrollJob.fail_stale(period)
+    if not period.is_processed and not period.jobs.filter(status__in=['PENDING', 'RUNNING']).exists():
+        job = PayrollJob.objects.create(company=period.company, period=period)
+        threshold = getattr(settings, 'PAYROLL_ASYNC_THRESHOLD', None)
+        headcount = Employee.objects.filter(company=period.company, is_active=True).count()
+        if threshold is not None and headcount >= threshold:
+            transaction.on_commit(lambda: _enqueue_payroll(job))
+        else:
+            # Same task, run in the request; payslips stay a draft until finalized
+            process_bulk_payroll(period.id, period.company_id, job_id=job.id, finalize=False)
+
     from django.urls import reverse
     response = HttpResponse()
     response['HX-Redirect'] = reverse('run_payroll', args=[period.id])
     return response
 
+def _enqueue_payroll(job):
+    try:
+        process_bulk_payroll.delay(job.period_id, job.company_id, job_id=job.id, finalize=False)
+    except Exception as exc:
+        # Broker down: fail the job now rather than leave it PENDING, which
+        # would block the next run until it goes stale
+        job.mark_failed(f"Could not queue the run: {exc}")
+
 @require_POST
 @login_required
 def finalize_payroll(request, period_id):
     period = get_object_or_404(PayrollPeriod, id=period_id)
-    period.is_processed = True
-    period.save()
+    # Outdated payslips are recomputed first, then the configuration is frozen
+    PayrollBatch(period).finalize()
     return redirect('payroll_dashboard')
 
+@require_POST
+@login_required
+def recompute_payroll(request, period_id):
+    """
+    Recalculates only the payslips flagged as dirty since they were generated
+    (attendance, leave, salary, rule or tax bracket changes).
+    """
+    period = get_object_or_404(PayrollPeriod, id=period_id)
+    try:
+        PayrollBatch(period).recompute_dirty()
+    except ValueError as exc:
+        messages.error(request, str(exc))
+    return redirect('run_payroll', period_id=period.id)
+
 @login_required
 def run_payroll(request, period_id):
+    """
+    Payslips of the period, the first page only: the following ones are
+    loaded by run_payroll_rows as the table is scrolled.
+    """
     period = get_object_or_404(PayrollPeriod, id=period_id)
-    payslips = Payslip.objects.filter(period=period).order_by('employee__last_name')
-    
-    total_cost = payslips.aggregate(Sum('net_pay'))['net_pay__sum'] or 0
+    summary = period_totals(period)
+    dirty_count = Payslip.objects.filter(period=period, is_dirty=True).count()
+    PayrollJob.fail_stale(period)
+    job = period.jobs.order_by('-created_at').first()
     
     return render(request, 'payroll/run_payroll.html', {
         'period': period,
-        'payslips': payslips,
-        'total_cost': total_cost
+        'page': _payslip_page(period),
+        'headcount': summary.headcount,
+        'total_cost': summary.net_pay,
+        'dirty_count': dirty_count,
+        'job': job,
     })
 
-@require_POST
-def update_payslip_bonus(request, payslip_id):
-    payslip = get_object_or_404(Payslip, id=payslip_id)
-    new_bonus = request.POST.get('bonus')
-    
+# Payslips per page of the run screen, ordered by employee name
+PAYSLIP_PAGE_SIZE = 50
+PAYSLIP_ORDERING = ['employee__last_name', 'employee_id']
+
+def _payslip_page(period, cursor=None):
+    payslips = (
+        # Redundant company filter, so the employee (company, last_name, id)
+        # index can drive the ordering
+        Payslip.objects.filter(period=period, employee__company_id=period.company_id)
+        .select_related('employee__position')
+    )
+    return keyset_page(payslips, PAYSLIP_ORDERING, cursor, PAYSLIP_PAGE_SIZE)
+
+@login_required
+def run_payroll_rows(request, period_id):
+    """HTMX View: the next page of payslip rows of the run screen (keyset pagination)."""
+    period = get_object_or_404(PayrollPeriod, id=period_id)
     try:
-        payslip.bonus = float(new_bonus)
-        # Recalculate Net Pay: Gross + Bonus - Deductions
-        # Note: Deductions might need re-calc if they are percentage based on (Gross + Bonus)
-        # For simplicity, assuming Deductions are fixed based on Base Gross.
-        payslip.net_pay = float(payslip.gross_pay) + payslip.bonus - float(payslip.total_deductions)
-        payslip.save()
-        
-        # Calculate new total for OOB update
-        total_cost = Payslip.objects.filter(period=payslip.period).aggregate(Sum('net_pay'))['net_pay__sum'] or 0
-        
-        return render(request, 'payroll/partials/payslip_update.html', {
-            'payslip': payslip,
-            'total_cost': total_cost
-        })
+        page = _payslip_page(period, request.GET.get('after'))
     except ValueError:
+        return HttpResponseBadRequest("Invalid cursor")
+    return render(request, 'payroll/partials/payslip_rows.html', {'period': period, 'page': page})
+
+@login_required
+def export_payroll_timings(request, period_id):
+    """CSV of the per-stage timings recorded for every run of the period."""
+    period = get_object_or_404(PayrollPeriod, id=period_id)
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="payroll_timings_{period.id}.csv"'
+    write_timings_csv(period.jobs.order_by('created_at'), response)
+    return response
+
+@login_required
+def payroll_job_progress(request, job_id):
+    """
+    HTMX View: progress bar of a payroll run, polled by the run page.
+    Once the job is over the page is refreshed to show the payslips.
+    """
+    job = get_object_or_404(PayrollJob, id=job_id)
+    response = render(request, 'payroll/partials/job_progress.html', {'job': job})
+    if not job.is_active and request.GET.get('polling'):
+        response['HX-Refresh'] = 'true'
+    return response
+
+@require_POST
+def update_payslip_bonus(request, payslip_id):
+    payslip = get_object_or_404(Payslip.objects.select_related('period'), id=payslip_id)
+    form = BonusForm({'bonus': request.POST.get('bonus') or '0'})
+    if not form.is_valid():
         return HttpResponseBadRequest("Invalid Input")
 
+    # Bonus tax, deductions, net pay and the period total move by the
+    # difference with the old bonus (Decimal maths, no re-aggregation)
+    payslip = PayrollBatch(payslip.period).update_bonuses({payslip.id: form.cleaned_data['bonus']})[0]
+    total_cost = period_totals(payslip.period).net_pay
+
+    return render(request, 'payroll/partials/payslip_update.html', {
+        'payslip': payslip,
+        'total_cost': total_cost
+    })
+
+@login_required
+def bulk_update_bonuses(request, period_id):
+    """
+    Bonus entry for many payslips at once: a CSV upload with payslip_id and
+    bonus columns, or bonus-<payslip_id> fields posted together. Nothing is
+    saved unless every row is valid and belongs to the period.
+    """
+    period = get_object_or_404(PayrollPeriod, id=period_id)
+    form = BonusUploadForm()
+    errors = []
+    if request.method == 'POST':
+        bonuses = None
+        if request.FILES:
+            form = BonusUploadForm(request.POST, request.FILES)
+            if form.is_valid():
+                bonuses = form.cleaned_data['csv_file']
+            else:
+                errors = [error for field_errors in form.errors.values() for error in field_errors]
+        else:
+            bonuses, errors = parse_bonuses(
+                (name, name[len('bonus-'):], value)
+                for name, value in request.POST.items() if name.startswith('bonus-')
+            )
+            if not bonuses and not errors:
+                errors.append("No bonuses were submitted.")
+
+        if bonuses is not None and not errors:
+            known = set(
+                Payslip.objects.filter(period=period, id__in=list(bonuses)).values_list('id', flat=True)
+            )
+            errors = [f"Payslip {payslip_id} is not part of this period" for payslip_id in bonuses if payslip_id not in known]
+            if not errors:
+                updated = PayrollBatch(period).update_bonuses(bonuses)
+                messages.success(request, f"Bonuses saved for {len(updated)} payslip{'s' if len(updated) != 1 else ''}.")
+                return redirect('run_payroll', period_id=period.id)
+
+    return render(request, 'payroll/bulk_bonus.html', {
+        'period': period,
+        'form': form,
+        'errors': errors,
+    })
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+@login_required
+def export_period_payslips(request, period_id, file_format):
+    """
+    Every payslip of the period with employee, department and bank details,
+    as CSV or XLSX, streamed from a chunked queryset (see payroll.exports).
+    """
+    period = get_object_or_404(PayrollPeriod, id=period_id)
+    payslips = Payslip.objects.filter(period=period).order_by('employee__last_name', 'employee_id')
+    response = StreamingHttpResponse(
+        stream_payslip_export(payslips, file_format, sheet_name=f'Payroll {period.start_date:%Y-%m}'),
+        content_type=EXPORT_CONTENT_TYPES[file_format],
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="payroll_{period.start_date:%Y-%m}_{period.id}.{file_format}"'
+    )
+    return response
+
+@login_required
+def download_bank_files(request, period_id):
+    """
+    ZIP of the period's bank transfer files, one per bank, fixed-width or
+    ?format=csv, streamed while written (see payroll.bank_files). Only for
+    processed periods: amounts must not change after the files are sent.
+    """
+    period = get_object_or_404(PayrollPeriod.objects.select_related('company'), id=period_id)
+    file_format = request.GET.get('format', 'fixed')
+    if file_format not in BANK_FILE_FORMATS:
+        return HttpResponseBadRequest("Unknown bank file format")
+    if not period.is_processed:
+        messages.error(request, "Bank files can only be generated for finalized periods.")
+        return redirect('run_payroll', period_id=period.id)
+
+    payslips = Payslip.objects.filter(period=period)
+    response = StreamingHttpResponse(
+        stream_bank_files(period, payslips, file_format), content_type='application/zip',
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="bank_files_{period.end_date:%Y%m%d}_{period.id}_{file_format}.zip"'
+    )
+    return response
+
+@login_required
+def export_period_bonuses(request, period_id):
+    """CSV of the period's payslips and bonuses, in the format bulk_update_bonuses reads."""
+    period = get_object_or_404(PayrollPeriod, id=period_id)
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="payroll_bonuses_{period.id}.csv"'
+    writer = csv.writer(response)
+    writer.writerow(['payslip_id', 'employee', 'email', 'bonus'])
+    rows = (
+        Payslip.objects.filter(period=period)
+        .order_by('employee__last_name', 'employee__first_name', 'id')
+        .values_list('id', 'employee__first_name', 'employee__last_name', 'employee__email', 'bonus')
+    )
+    for payslip_id, first_name, last_name, email, bonus in rows.iterator():
+        writer.writerow([payslip_id, f'{first_name} {last_name}', email, bonus])
+    return response
+
+def _document_payslip(request, payslip_id):
+    # Loaded once per request, for both the ETag and the view
+    if getattr(request, '_payroll_payslip_id', None) != payslip_id:
+        request._payroll_payslip_id = payslip_id
+        request._payroll_payslip = (
+            Payslip.objects.select_related('employee__position', 'employee__company', 'period')
+            .filter(id=payslip_id).first()
+        )
+    return request._payroll_payslip
+
+def _document_etag(kind):
+    def etag(request, payslip_id):
+        payslip = _document_payslip(request, payslip_id)
+        return document_key(payslip, kind) if payslip else None
+    return etag
+
+def _document_response(request, payslip_id, kind):
+    payslip = _document_payslip(request, payslip_id)
+    if payslip is None:
+        raise Http404("No Payslip matches the given query.")
+    content, content_type = cached_document(
+        payslip, kind, base_url=request.build_absolute_uri('/'), key=_document_etag(kind)(request, payslip_id),
+    )
+    response = HttpResponse(content, content_type=content_type)
+    # Stored by the browser but revalidated: unchanged payslips get a 304
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@condition(etag_func=_document_etag('modal'))
 def load_payslip_modal(request, payslip_id):
     """
     HTMX View: Returns a modal content with payslip details.
     Trigger: <button hx-get="/payroll/payslip/1/" hx-target="#modal-content">View</button>
+    Rendered once per payslip version, see payroll.pdf.cached_document().
     """
-    payslip = get_object_or_404(Payslip, id=payslip_id)
-    return render(request, 'payroll/payslip_modal.html', {'payslip': payslip})
+    return _document_response(request, payslip_id, 'modal')
 
+@condition(etag_func=_document_etag('pdf'))
 def generate_payslip_pdf(request, payslip_id):
     """
     Generates a PDF for the payslip using WeasyPrint.
+    Without WeasyPrint installed (pip install weasyprint) the HTML is returned.
+    Rendered once per payslip version, see payroll.pdf.cached_document().
     """
-    payslip = get_object_or_404(Payslip, id=payslip_id)
-    html_string = render_to_string('payroll/payslip_pdf.html', {'payslip': payslip})
-    
-    # For demonstration without WeasyPrint installed:
-    # We return the HTML with a script to auto-print or just view.
-    # To enable WeasyPrint:
-    # 1. pip install weasyprint
-    # 2. uncomment the lines below
-    
-    # import weasyprint
-    # pdf_file = weasyprint.HTML(string=html_string).write_pdf()
-    # response = HttpResponse(pdf_file, content_type='application/pdf')
-    # response['Content-Disposition'] = f'filename="payslip_{payslip.id}.pdf"'
-    # return response
+    response = _document_response(request, payslip_id, 'pdf')
+    if response['Content-Type'] == PDF_CONTENT_TYPE:
+        response['Content-Disposition'] = f'filename="payslip_{payslip_id}.pdf"'
+    return response
 
-    return HttpResponse(html_string)
+@login_required
+def download_period_payslips(request, period_id):
+    """
+    ZIP of every payslip of the period, rendered by a process pool and
+    streamed while it is being built (HTML files without WeasyPrint).
+    """
+    period = get_object_or_404(PayrollPeriod, id=period_id)
+    payslips = Payslip.objects.filter(period=period).order_by('employee__last_name', 'employee__first_name', 'id')
+    response = StreamingHttpResponse(
+        stream_period_zip(payslips, base_url=request.build_absolute_uri('/')),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = f'attachment; filename="payslips_{period.start_date:%Y-%m}_{period.id}.zip"'
+    return response
@@ -0,0 +1,28 @@
+"""
+Entry points of the process pool used by PayrollBatch.run_sharded().
+
+The pool spawns fresh interpreters, which unpickle these functions by
+importing this module before Django is set up, so nothing here may import
+models at module level.
+"""
+from .instrumentation import NULL_TIMER, StageTimer
+
+
+def init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def compute_shard(period_id, company_id, first_id, last_id, vectorized=None, timed=False):
+    """Returns the shard's results and its stage timings (empty unless `timed`)."""
+    from core.models import Company
+    from .models import PayrollPeriod
+    from .services import PayrollBatch
+    timer = StageTimer() if timed else NULL_TIMER
+    with timer.recording():
+        period = PayrollPeriod.objects.get(id=period_id)
+        company = Company.objects.get(id=company_id)
+        results = PayrollBatch(period, company, vectorized=vectorized, timer=timer).calculate_shard(first_id, last_id)
+    return results, timer.as_dict()
@@ -20,6 +20,53 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Payroll Engine
+# Compute batch runs with the NumPy fixed-point kernel (payroll/kernels.py).
+# Requires numpy; results are identical to the Decimal engine.
+PAYROLL_VECTORIZED = False
+# Payslips per INSERT ... ON CONFLICT statement when saving a run
+PAYROLL_WRITE_BATCH_SIZE = 1000
+# How process_bulk_payroll spreads a run: 'serial', 'processes' (local
+# process pool) or 'celery' (parallel subtasks, works with eager mode too)
+PAYROLL_SHARD_MODE = 'serial'
+PAYROLL_SHARD_SIZE = 5000  # Employees per shard
+PAYROLL_WORKERS = None  # Process pool size, defaults to the number of CPUs
+# Runs started from the Run Payroll button with at least this many active
+# employees go to Celery (progress is shown on the run page); None = never
+PAYROLL_ASYNC_THRESHOLD = 2000
+# Seconds without progress after which a pending or running payroll job is
+# considered dead (worker killed, never queued) and no longer blocks a new run
+PAYROLL_JOB_STALE_AFTER = 15 * 60
+# Record per-stage durations and query counts of every run on its PayrollJob
+PAYROLL_STAGE_TIMINGS = False
+# Seconds the per-tenant dashboard figures are cached; they are also dropped
+# whenever payslips, periods, employees or departments change
+PAYROLL_DASHBOARD_CACHE_TIMEOUT = 300
+# Processes converting payslips to PDF for a period download (defaults to
+# PAYROLL_WORKERS) and payslips handed to each of them at a time
+PAYROLL_PDF_WORKERS = None
+PAYROLL_PDF_CHUNK_SIZE = 25
+# Cache alias and lifetime of rendered payslip documents (payroll/pdf.py).
+# Keys are content hashes, so a shared cache (e.g. FileBasedCache on disk)
+# can be used by every process without invalidation.
+PAYROLL_DOCUMENT_CACHE = 'documents'
+PAYROLL_DOCUMENT_CACHE_TIMEOUT = 7 * 24 * 3600
+
+# Shared by the web processes and the Celery workers: dashboard figures are
+# invalidated by whichever process writes the payslips. Redis database 1,
+# the broker uses 0.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    },
+    # Rendered PDFs are large; keep them out of Redis
+    'documents': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'payroll-documents',
+    },
+}
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
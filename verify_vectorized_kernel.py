@@ -0,0 +1,86 @@
+import os
+import random
+import django
+from decimal import Decimal
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'staffcore.settings')
+django.setup()
+
+from payroll.models import SalaryRule, TaxBracket
+from payroll.services import calculate_pay
+from payroll.kernels import calculate_payslips
+from payroll.rules import RulePlan
+from payroll.tax import TaxTable
+
+def random_money(low, high):
+    return Decimal(random.randint(low * 100, high * 100)) / 100
+
+def build_config(employee_ids):
+    """Unsaved rules & brackets, the kernel only needs their columns."""
+    rules = []
+    for i in range(random.randint(0, 6)):
+        rule = SalaryRule(
+            id=i + 1,
+            name=f"Rule {i}",
+            rule_type=random.choice(['ALLOWANCE', 'DEDUCTION']),
+            is_global=random.random() < 0.6,
+        )
+        if random.random() < 0.5:
+            rule.amount = random_money(0, 500)
+        else:
+            rule.percentage = random_money(0, 30)
+        rules.append(rule)
+
+    brackets = []
+    start = Decimal('0.00')
+    for i in range(random.randint(0, 6)):
+        end = start + random_money(100, 4000)
+        last = i == 5 or random.random() < 0.2
+        brackets.append(TaxBracket(
+            min_income=start,
+            max_income=None if last else end,
+            tax_rate=random_money(0, 40),
+            deduction_amount=random_money(0, 300),
+        ))
+        if last:
+            break
+        start = end + Decimal('0.01')
+    assignments = [
+        (rule.id, employee_id)
+        for rule in rules if not rule.is_global
+        for employee_id in random.sample(employee_ids, len(employee_ids) // 3)
+    ]
+    return RulePlan(rules, assignments), TaxTable(brackets)
+
+def verify_parity(rounds=50, employees_per_round=2000):
+    print("Verifying vectorized kernel against the Decimal engine...")
+    random.seed(2024)
+    mismatches = 0
+    checked = 0
+
+    for _ in range(rounds):
+        employees = [(i, random_money(0, 50000)) for i in range(employees_per_round)]
+        rule_plan, tax_table = build_config([employee_id for employee_id, _salary in employees])
+        attendance = {}
+        for employee_id, _salary in employees:
+            # Mix of whole-minute punches and odd seconds to hit rounding ties
+            overtime = random.choice([0, random.randint(0, 80) * 60, random.randint(0, 300000)])
+            attendance[employee_id] = (overtime + random.randint(0, 200) * 3600, overtime)
+
+        vectorized = dict(calculate_payslips(employees, attendance, rule_plan, tax_table))
+        for employee_id, salary in employees:
+            expected = calculate_pay(salary, *attendance[employee_id], rule_plan.rules_for(employee_id), tax_table)
+            checked += 1
+            if vectorized[employee_id] != expected:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"FAIL: employee {employee_id}: {vectorized[employee_id]} != {expected}")
+
+    if mismatches:
+        print(f"FAIL: {mismatches} of {checked} payslips differ")
+    else:
+        print(f"PASS: {checked} payslips identical")
+    return mismatches == 0
+
+if __name__ == "__main__":
+    verify_parity()